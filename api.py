@@ -1,48 +1,95 @@
-import base64
-import re
-import shutil
-from multiprocessing import Process, Pipe
 import workers
-from svglib.svglib import svg2rlg
-from reportlab.pdfgen import canvas
-from reportlab.graphics import renderPDF
-import verovio
+from worker_pool import (
+    JobCancelled, ModelPool, PoolBusy, WorkerCrashed, WorkerError, WorkerTimeout, assign_cpus, configure_forkserver,
+)
 from io import BytesIO
-from fastapi import FastAPI, Form, HTTPException, UploadFile, File
-from pathlib import Path
-from fastapi.responses import Response
+from fastapi import FastAPI, Form, HTTPException, Request, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
-from midi2audio import FluidSynth
+import synth
+import score_render
+import audio_output
+import responses
+import uploads
+import timing
+import metrics
+import profiling
+import jobs
+import coalescing
+import json
+import uuid
+import mido
 import os
-import subprocess
+import shutil
+import tempfile
+import time
+import asyncio
+
+# "forkserver" - workery forkowane z procesu z załadowanymi bibliotekami (model_preload.py), współdzielą pamięć
+_start_method = os.environ.get("FASTSCORE_WORKER_START") or None
+if _start_method == "forkserver":
+    configure_forkserver(["model_preload"])
+
+# domyślny termin zadania: co najmniej sekunda przetwarzania na sekundę najdłuższego przyjmowanego nagrania
+_default_job_timeout_s = max(300, int(uploads.MAX_DURATION_S))
+
+def _pool_settings(prefix):
+    # np. FASTSCORE_CREPE_WORKERS, FASTSCORE_CREPE_MAX_QUEUE, FASTSCORE_CREPE_JOB_TIMEOUT_S
+    def env_int(name, default):
+        value = os.environ.get(f"FASTSCORE_{prefix}_{name}")
+        return int(value) if value else default
+    size = env_int("WORKERS", 1)
+    job_timeout = env_int("JOB_TIMEOUT_S", _default_job_timeout_s)
+    if job_timeout < uploads.MAX_DURATION_S:
+        print(f"FASTSCORE_{prefix}_JOB_TIMEOUT_S={job_timeout} is shorter than FASTSCORE_MAX_DURATION_S="
+              f"{uploads.MAX_DURATION_S:g} - the longest accepted recordings may time out")
+    return {
+        "size": size,
+        "max_concurrency": env_int("MAX_CONCURRENCY", size),
+        "max_queue": env_int("MAX_QUEUE", 8),
+        "job_timeout": job_timeout,
+        # 0 = bez recyklingu
+        "max_jobs": env_int("MAX_JOBS", 0) or None,
+        "max_rss_mb": env_int("MAX_RSS_MB", 0) or None,
+        # wątki BLAS/OpenMP/TensorFlow na workera, 0 = domyślne ustawienia bibliotek
+        "threads": env_int("THREADS", 0) or None,
+        "start_method": _start_method,
+    }
 
-pipes = []
-def newPipe():
-    parent, child = Pipe()
-    pipes.append(parent)
-    return parent, child
+_crepe_settings = _pool_settings("CREPE")
+_bp_settings = _pool_settings("BP")
+if os.environ.get("FASTSCORE_PIN_CPUS") == "1":
+    # każdy worker dostaje własne rdzenie (tyle, ile ma wątków)
+    _crepe_settings["cpus"], _bp_settings["cpus"] = assign_cpus([
+        (s["size"], s["threads"] or 1) for s in (_crepe_settings, _bp_settings)
+    ])
 
-crepe_pipe, crepe_child = newPipe()
-bp_pipe, bp_child = newPipe()
-# melody_ext_pipe, melody_ext_child = newPipe()
+crepe_pool = ModelPool("crepe", workers.crepe_worker, **_crepe_settings)
+bp_pool = ModelPool("basic_pitch", workers.basic_pitch_worker, **_bp_settings)
+# melody_ext_pool = ModelPool("melody_ext", workers.melody_ext_worker)
+pools = [crepe_pool, bp_pool]
+metrics.register_pools(pools)
+
+synth_pool = synth.SynthPool(synth.find_soundfont("FluidR3_GM.sf2"))
+audio_cache = audio_output.EncodedAudioCache()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    processes = [
-        Process(target=workers.crepe_worker, args=(crepe_child,), daemon=True),
-        Process(target=workers.basic_pitch_worker, args=(bp_child,), daemon=True),
-        # Process(target=workers.melody_ext_worker, args=(melody_ext_child,), daemon=True),
-    ]
-    for p in processes:
-        p.start()
+    # workery ładują i rozgrzewają modele w tle, gotowość raportuje /ready
+    for pool in pools:
+        pool.start()
+    try:
+        await run_in_threadpool(synth_pool.preload)
+    except Exception as e:
+        # brak soundfontu lub libfluidsynth nie blokuje transkrypcji - silniki powstaną przy pierwszym
+        # żądaniu /midi-to-audio (i tam zgłoszą błąd)
+        print(f"Synth preload failed: {e!r}")
     yield
-    for pipe in pipes:
-        pipe.send(None)
-    for p in processes:
-        if p.is_alive():
-            p.kill()
-            p.join(timeout=3)
+    for pool in pools:
+        pool.stop()
+    synth_pool.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -54,180 +101,668 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-_upload_dir = "uploads"
+job_registry = jobs.JobRegistry()
+# konwersje w trybie progresywnym (progressive=1) działające po wysłaniu odpowiedzi 202
+_background_tasks = set()
+in_flight = coalescing.SingleFlight()
 
-def convert_opus_to_wav(input_path, timeout=10):
-    input_path = Path(input_path)
-    output_path = input_path.with_suffix(".wav")
-
-    cmd = [
-        "ffmpeg",
-        "-nostdin",
-        "-y",
-        "-v", "error",
-        "-i", str(input_path),
-        "-ac", "1",
-        "-ar", "44100",
-        str(output_path)
-    ]
+_upload_dir = "uploads"
+# nagrania dłuższe niż tyle sekund są dzielone w miejscach ciszy i transkrybowane równolegle (0 = wyłączone)
+_split_min_s = float(os.environ.get("FASTSCORE_SPLIT_MIN_S", "120"))
+# części jednego nagrania przetwarzane jednocześnie (0 = połowa workerów puli, co najmniej 2) - jedno długie
+# nagranie nie zajmuje wszystkich workerów
+_split_parallel = int(os.environ.get("FASTSCORE_SPLIT_PARALLEL", "0"))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe_request(route.path if route else "unmatched", response.status_code, time.perf_counter() - start)
+    return response
+
+def _request_job_id(request: Request):
+    # identyfikator nadany przez klienta (nagłówek X-Job-Id lub parametr job_id) albo nowy
+    job_id = getattr(request.state, "job_id", None)
+    if job_id is None:
+        job_id = jobs.parse_job_id(request.headers.get("x-job-id") or request.query_params.get("job_id"))
+        request.state.job_id = job_id = job_id or jobs.new_job_id()
+    return job_id
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    # bez poprawnego tokenu żądanie nie jest profilowane - koszt to jedno sprawdzenie nagłówka
+    if not profiling.requested(request.headers, request.query_params):
+        return await call_next(request)
+    with profiling.RequestProfile(_request_job_id(request)) as profile:
+        request.state.profile = profile
+        response = await call_next(request)
+    response.headers["X-Job-Id"] = profile.job_id
+    response.headers["X-Profile-Url"] = f"/profiles/{profile.job_id}"
+    return response
+
+def _timed_response(request: Request, response: Response, timer: timing.StageTimer):
+    response.headers["Server-Timing"] = timer.server_timing()
+    metrics.observe_stages(request.scope["route"].path, timer)
+    return response
+
+def conversion_response(request: Request, xml_data, midi_bytes, fields=None):
+    mode = responses.negotiate(request.headers.get("accept"))
+    body, media_type = responses.conversion_body(
+        mode, xml_data, midi_bytes, accept_encoding=request.headers.get("accept-encoding"), fields=fields
+    )
+    if mode == "json":
+        return JSONResponse(content=body)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept, Accept-Encoding"})
+
+def notes_response(request: Request, notes, fields=None):
+    mode = responses.negotiate_notes(request.headers.get("accept"))
+    body, media_type = responses.notes_body(mode, notes, fields)
+    if mode == "json":
+        return JSONResponse(content=body)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+def _should_split(pool: ModelPool, audio_file_path):
+    if not _split_min_s or pool.size < 2:
+        return False
+    duration = uploads.file_duration(audio_file_path)
+    # nieznana długość (format zapisany bez dekodowania) - bez podziału, krótkie nagranie nie płaci za fan-out
+    return duration is not None and duration >= _split_min_s
+
+async def transcribe_in_chunks(pool: ModelPool, job, timer: timing.StageTimer, progress: jobs.Job = None,
+                               is_disconnected=None):
+    """
+    Transcribes a long recording split at silence: the chunks and the tempo run as parallel jobs on the
+    pool, the notes are stitched with their absolute onsets and written to MIDI / MusicXML by a final job
+    (or returned as they are for a "notes" job).
+
+    :param progress: Job receiving the progress events (share of finished chunks instead of inference %)
+    :param is_disconnected: See ModelPool.submit
+    :return: (path to the MusicXML file, path to the MIDI file), the notes for a "notes" job
+    """
+    chunk_dir = tempfile.mkdtemp(dir=_upload_dir)
+    notes_only = job.get("kind") == "notes"
+    on_progress = None if progress is None else (lambda event: progress.stage_event(*event))
+    parallel = min(pool.size, _split_parallel or max(2, pool.max_concurrency // 2))
+    in_flight_parts = asyncio.Semaphore(parallel)
+
+    def submit(part_job, part_timer=None, part_progress=None):
+        return pool.submit(part_job, is_disconnected=is_disconnected, timer=part_timer, admit=False,
+                           on_progress=part_progress)
+
+    async def submit_part(name, part_job):
+        # zadania częściowe profilowanego żądania zapisują własne profile obok worker.prof
+        if job.get("profile"):
+            part_job["profile"] = profiling.part_profile_path(job["profile"], name)
+        async with in_flight_parts:
+            return await submit(part_job)
 
     try:
-        subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=timeout,
-            check=True
-        )
-    except subprocess.TimeoutExpired:
-        print("FFmpeg timeout — proces zawiesił się.")
-        raise
-    except subprocess.CalledProcessError as e:
-        print("FFmpeg error:", e.stderr.decode())
+        with timer.stage("split"):
+            chunks = await submit_part("split", {
+                "kind": "split", "audio_path": job["audio_path"], "chunk_dir": chunk_dir,
+                # liczba części niezależna od limitu równoległości - ten ogranicza tylko semafor
+                "parts": pool.size, "min_duration": _split_min_s,
+            })
+        if len(chunks) == 1:
+            return await submit(job, timer, on_progress)
+
+        finished = []
+
+        async def submit_chunk(index, path):
+            notes = await submit_part(f"chunk{index}", {
+                "kind": "notes", "audio_path": path, "preprocessing": job["preprocessing"],
+                # wycięcie ciszy przesunęłoby nuty względem początku części, a więc i całego nagrania
+                "trim_silence": False,
+            })
+            finished.append(path)
+            if progress is not None:
+                progress.stage_event("progress", "chunks", len(finished) / len(chunks))
+            return notes
+
+        # czasy etapów w częściach nakładają się - do Server-Timing trafia tylko czas całej fazy
+        with timer.stage("chunks"):
+            parts = asyncio.gather(*(submit_chunk(i, path) for i, (path, _) in enumerate(chunks, 1)))
+            if notes_only:
+                # sama lista nut nie potrzebuje tempa
+                chunk_notes = await parts
+            else:
+                bpm, chunk_notes = await asyncio.gather(
+                    submit_part("tempo", {"kind": "tempo", "audio_path": job["audio_path"]}), parts
+                )
+        notes = [
+            (onset + offset, offset_time + offset, pitch, amp)
+            for (_, offset), part in zip(chunks, chunk_notes)
+            for onset, offset_time, pitch, amp in part
+        ]
+        print(f"Połączono {len(notes)} nut z {len(chunks)} części")
+        if notes_only:
+            return notes
+        score_job = {
+            "kind": "score", "notes": notes, "bpm": bpm, "xml": job.get("xml", True),
+            "output_dir": job.get("output_dir"), "profile": job.get("profile"),
+        }
+        return await submit(score_job, timer, on_progress)
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+def _job_error(exc):
+    # status i opis błędu dla zdarzenia "error" - takie same jak w odpowiedzi HTTP
+    if isinstance(exc, (HTTPException, uploads.UploadRejected)):
+        return {"status": exc.status_code, "detail": exc.detail}
+    if isinstance(exc, PoolBusy):
+        return {"status": 429, "detail": str(exc), "retry_after": exc.retry_after}
+    if isinstance(exc, JobCancelled):
+        return {"status": 499, "detail": "Client disconnected"}
+    if isinstance(exc, WorkerError):
+        return {"status": 500, "detail": "Transcription failed"}
+    return {"status": 500, "detail": "Internal error"}
+
+async def audio_to_xml(pool: ModelPool, request: Request, preprocessing=False, split=False):
+    # zdarzenia konwersji dostępne w /jobs/{id} i /jobs/{id}/events
+    job_id = _request_job_id(request)
+    try:
+        job = job_registry.start(job_id, pool.name)
+    except jobs.JobConflict:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is already running")
+    try:
+        response = await _convert_audio(pool, request, job, preprocessing, split)
+    except BaseException as e:
+        job.finish("error", **_job_error(e))
         raise
-
-    return output_path
-
-def audio_to_xml(convert_pipe, file: UploadFile, preprocessing=False):
-    print("Received file:", file.filename)
-
-    # ensure directory exists
-    os.makedirs(_upload_dir, exist_ok=True)
-    audio_file_path = os.path.join(_upload_dir, file.filename)
-
-    # ensure filename is unique
-    if os.path.exists(audio_file_path):
-        base, ext = os.path.splitext(audio_file_path)
-        i = 1
-        while os.path.exists(new_path := f"{base}_{i}{ext}"):
-            i += 1
-        audio_file_path = new_path
-    with open(audio_file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # convert opus file
-    if Path(audio_file_path).suffix.lower() == ".opus":
-        audio_file_path = convert_opus_to_wav(audio_file_path)
+    if isinstance(response, Response):
+        response.headers["X-Job-Id"] = job.id
+        # 202 - tryb progresywny, zadanie kończy się w tle
+        if response.status_code != 202:
+            job.finish("done", status=response.status_code)
+    return response
+
+def _flag(value, default=False):
+    if value is None or value == "":
+        return default
+    return value.lower() not in ("0", "false", "no", "off")
+
+async def _convert_audio(pool: ModelPool, request: Request, job: jobs.Job, preprocessing, split):
+    # pełna kolejka - odrzucamy zanim odbierzemy plik
+    pool.check_admission()
+    timer = timing.StageTimer(job.stage_event)
+    # plik jest odbierany strumieniowo - limity rozmiaru i długości sprawdzane w trakcie wysyłania
+    with timer.stage("upload"):
+        audio_file_path, filename, fields, digest = await uploads.receive_upload(request, _upload_dir)
+    print("Received file:", filename)
+
+    def option(name):
+        # pole formularza lub parametr zapytania
+        return fields.get(name) or request.query_params.get(name)
+
+    # opcjonalny fragment nagrania, np. start=1:20 end=1:45
+    time_range = uploads.parse_time_range(option("start"), option("end"))
+    response_fields = None
+    if time_range is not None:
+        with timer.stage("extract"):
+            range_path = await run_in_threadpool(uploads.extract_range, audio_file_path, *time_range)
+        os.remove(audio_file_path)
+        audio_file_path = range_path
+        # nuty w MIDI / MusicXML liczone są od początku wybranego fragmentu
+        response_fields = {"start": time_range[0], "end": time_range[1]}
 
     # audio processing
-    convert_pipe.send((audio_file_path, preprocessing))
-    xml_file_path, midi_file_path = convert_pipe.recv()
-    print(f"otrzymane xml: {xml_file_path}")
-    if xml_file_path == "" or midi_file_path == "":
-        print(f"Filepath error: xml {xml_file_path}, midi {midi_file_path}")
-        return ""
+    worker_job = {"audio_path": audio_file_path, "preprocessing": preprocessing}
+    # xml=0 - tylko MIDI, etap music21 w ogóle się nie wykonuje
+    if not _flag(option("xml"), default=True):
+        worker_job["xml"] = False
+    # output=notes - sama lista nut (fortepian rolkowy), bez MIDI i MusicXML
+    output = option("output") or "score"
+    if output not in ("score", "notes"):
+        raise HTTPException(status_code=400, detail=f"Unsupported output: {output}")
+    if output == "notes":
+        worker_job["kind"] = "notes"
+    profile = getattr(request.state, "profile", None)
+    if profile is not None:
+        worker_job["profile"] = profile.worker_profile_path
+    split = split and _should_split(pool, audio_file_path)
+    # identyczne nagranie, model i opcje - łączone z konwersją w toku; profilowane żądanie ma własny przebieg
+    key = None
+    if profile is None:
+        key = (digest, pool.name, preprocessing, split, time_range, output, worker_job.get("xml", True))
+
+    if _flag(option("progressive")):
+        # odpowiedź od razu po odebraniu pliku, MIDI i MusicXML do pobrania z /jobs/{id}/... gdy będą gotowe
+        job.keep_results = True
+        task = asyncio.create_task(_convert_in_background(
+            pool, job, worker_job, timer, split, key, request.scope["route"].path
+        ))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return JSONResponse(status_code=202, content={
+            "job_id": job.id, "status_url": f"/jobs/{job.id}", "events_url": f"/jobs/{job.id}/events",
+            **(response_fields or {}),
+        })
 
-    # reading files and returning data
-    with open(xml_file_path, "r", encoding="utf-8") as f:
-        xml_data = f.read()
+    try:
+        result = await _conversion_result(pool, job, worker_job, timer, split, key, request.is_disconnected)
+    except WorkerError as e:
+        print(f"{pool.name} worker error: {e}")
+        job.finish("error", status=200, detail="Transcription failed")
+        return ""
+    if output == "notes":
+        with timer.stage("response"):
+            response = notes_response(request, result, response_fields)
+        job.add_result("notes", result)
+        return _timed_response(request, response, timer)
+    xml_data, midi_bytes = result
+
+    with timer.stage("response"):
+        response = conversion_response(request, xml_data, midi_bytes, response_fields)
+    if xml_data is not None:
+        job.add_result("xml", xml_data)
+    return _timed_response(request, response, timer)
+
+async def _transcribe(pool: ModelPool, job: jobs.Job, worker_job, timer: timing.StageTimer, split,
+                      is_disconnected=None):
+    """
+    :return: (path to the MusicXML file or None, path to the MIDI file), the notes for a "notes" job
+    :raises HTTPException: The worker timed out or crashed
+    """
+    try:
+        if split:
+            return await transcribe_in_chunks(pool, worker_job, timer, job, is_disconnected)
+        job.publish("queued", queued=pool.queued, running=pool.running)
+        return await pool.submit(
+            worker_job,
+            is_disconnected=is_disconnected,
+            timer=timer,
+            on_progress=lambda event: job.stage_event(*event),
+        )
+    except WorkerTimeout as e:
+        print(f"{pool.name} worker timeout: {e}")
+        raise HTTPException(status_code=504, detail="Transcription timed out")
+    except WorkerCrashed as e:
+        print(f"{pool.name} worker crashed: {e}")
+        raise HTTPException(status_code=500, detail="Transcription worker crashed")
+
+async def _conversion_result(pool: ModelPool, job: jobs.Job, worker_job, timer: timing.StageTimer, split, key=None,
+                             is_disconnected=None):
+    """
+    Runs the conversion, or waits for an identical one already in flight (same key) and shares its result.
+
+    :return: The notes for a "notes" job, otherwise (MusicXML or None, MIDI bytes)
+    """
+    async def convert(shared_is_disconnected):
+        if worker_job.get("kind") == "notes":
+            return await _transcribe(pool, job, worker_job, timer, split, shared_is_disconnected)
+        # każde zadanie zapisuje MIDI i MusicXML we własnym katalogu - równoległe workery nie nadpisują
+        # sobie plików; katalog usuwany po odczytaniu wyników
+        output_dir = tempfile.mkdtemp(dir=_upload_dir)
+        try:
+            result = await _transcribe(
+                pool, job, {**worker_job, "output_dir": output_dir}, timer, split, shared_is_disconnected
+            )
+            print(f"otrzymane xml: {result[0]}")
+            return _read_results(*result)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    if key is None:
+        return await convert(is_disconnected)
+    leader = in_flight.owner(key)
+    if leader is not None:
+        # postęp widoczny w strumieniu zdarzeń zadania, które wykonuje konwersję
+        job.publish("coalesced", job_id=leader)
+        os.remove(worker_job["audio_path"])
+    start = time.perf_counter()
+    result, shared = await in_flight.run(key, convert, is_disconnected, owner=job.id)
+    if shared:
+        timer.add("coalesced", time.perf_counter() - start)
+        metrics.observe_coalesced(pool.name)
+        print(f"{pool.name}: wynik współdzielony z zadaniem {leader}")
+    return result
+
+def _read_results(xml_file_path, midi_file_path):
+    xml_data = None
+    if xml_file_path is not None:
+        with open(xml_file_path, "r", encoding="utf-8") as f:
+            xml_data = f.read()
+        os.remove(xml_file_path)
     with open(midi_file_path, "rb") as f:
         midi_bytes = f.read()
-    midi_b64 = base64.b64encode(midi_bytes).decode("ascii")
-    os.remove(xml_file_path)
-    return {"xml": xml_data, "midi_base64": midi_b64}
+    return xml_data, midi_bytes
+
+async def _convert_in_background(pool: ModelPool, job: jobs.Job, worker_job, timer: timing.StageTimer, split, key,
+                                 route_path):
+    try:
+        result = await _conversion_result(pool, job, worker_job, timer, split, key)
+        if worker_job.get("kind") == "notes":
+            job.add_result("notes", result)
+            metrics.observe_stages(route_path, timer)
+            job.finish("done", status=200)
+            return
+        xml_data, midi_bytes = result
+        # MIDI bez wyniku częściowego, np. współdzielone z innym zadaniem
+        if "midi" not in job.results:
+            job.add_result("midi", {"midi": midi_bytes})
+        if xml_data is not None:
+            job.add_result("xml", xml_data)
+        metrics.observe_stages(route_path, timer)
+        job.finish("done", status=200)
+    except Exception as e:
+        print(f"{pool.name} background conversion failed: {e!r}")
+        job.finish("error", **_job_error(e))
+
+@app.exception_handler(uploads.UploadRejected)
+async def upload_rejected(request: Request, exc: uploads.UploadRejected):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+
+@app.exception_handler(PoolBusy)
+async def pool_busy(request: Request, exc: PoolBusy):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(JobCancelled)
+async def job_cancelled(request: Request, exc: JobCancelled):
+    # klient już się rozłączył, odpowiedź nie zostanie odebrana
+    print("Job cancelled, client disconnected")
+    return Response(status_code=499)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+def _check_profile_token(request: Request):
+    if not profiling.requested(request.headers, request.query_params):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+@app.get("/profiles/{job_id}")
+async def list_profile(request: Request, job_id: str):
+    _check_profile_token(request)
+    files = profiling.artifacts(job_id)
+    if not files:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {"job_id": job_id, "files": {name: f"/profiles/{job_id}/{name}" for name in files}}
+
+@app.get("/profiles/{job_id}/{name}")
+async def download_profile(request: Request, job_id: str, name: str):
+    _check_profile_token(request)
+    path = profiling.artifact_path(job_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/plain" if name.endswith(".txt") else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=f"{job_id}-{name}")
+
+def _parse_job_id(job_id):
+    parsed = jobs.parse_job_id(job_id)
+    if parsed is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return parsed
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = job_registry.get(_parse_job_id(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.summary()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(request: Request, job_id: str):
+    """
+    Server-Sent Events of a conversion: accepted, queued, stage (started / finished with seconds), progress
+    (percent of inference or of the chunks) and finally done or error. The stream can be opened before the
+    conversion is sent, with the same job ID in its X-Job-Id header or job_id parameter.
+    """
+    job = job_registry.watch(_parse_job_id(job_id))
+    return StreamingResponse(
+        jobs.sse_stream(job, request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        # bez buforowania w proxy (nginx), zdarzenia mają docierać od razu
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}/{name}")
+async def job_result(job_id: str, name: str):
+    """MIDI, MusicXML or note list of a progressive conversion, 202 while it's not ready yet."""
+    job = job_registry.get(_parse_job_id(job_id))
+    if job is None or name not in jobs.RESULTS:
+        raise HTTPException(status_code=404, detail="Job not found")
+    value = job.results.get(name)
+    if value is None:
+        if not job.finished and job.keep_results:
+            return JSONResponse(status_code=202, content={"status": job.status, "stage": job.stage},
+                                headers={"Retry-After": "1"})
+        raise HTTPException(status_code=404, detail=f"No {name} result")
+    if name == "midi":
+        return Response(content=value["midi"], media_type=responses.MIDI_TYPE)
+    if name == "notes":
+        return JSONResponse(content=responses.notes_body("json", value)[0])
+    return Response(content=value, media_type=responses.MUSICXML_TYPE)
+
+@app.get("/ready")
+async def ready():
+    status = {pool.name: pool.status() for pool in pools}
+    is_ready = all(s["ready"] > 0 and s["warm"] for s in status.values())
+    return JSONResponse(status_code=200 if is_ready else 503, content={"ready": is_ready, "models": status})
 
 @app.post("/convert-bp")
-async def convert_bp(file: UploadFile = File(...)):
-    return audio_to_xml(bp_pipe, file)
+async def convert_bp(request: Request):
+    return await audio_to_xml(bp_pool, request)
 
 @app.post("/convert-crepe")
-async def convert_crepe(file: UploadFile = File(...)):
-    return audio_to_xml(crepe_pipe, file)
+async def convert_crepe(request: Request):
+    return await audio_to_xml(crepe_pool, request, split=True)
 
 @app.post("/convert-crepe-preproc")
-async def convert_with_preprocessing(file: UploadFile = File(...)):
-    return audio_to_xml(crepe_pipe, file, preprocessing=True)
+async def convert_with_preprocessing(request: Request):
+    return await audio_to_xml(crepe_pool, request, preprocessing=True, split=True)
+
+# sesje na żywo działające jednocześnie (0 = tyle, ile zadań jednocześnie przyjmuje pula crepe)
+_live_max_sessions = int(os.environ.get("FASTSCORE_LIVE_MAX_SESSIONS", "0")) or crepe_pool.max_concurrency
+_live_sessions = 0
+
+@app.websocket("/ws/convert-crepe")
+async def convert_crepe_live(websocket: WebSocket):
+    """
+    Live transcription. The client sends a JSON config first ({"encoding": "pcm_f32le" | "pcm_s16le" | "webm" |
+    "ogg", "sample_rate": 16000, "channels": 1}), then binary audio chunks while recording, then {"type": "stop"}.
+    The server sends {"type": "notes", "notes": [...]} whenever notes become final and, after stop,
+    {"type": "score", "xml": ..., "midi_base64": ...}. An invalid config or control message closes the connection
+    with code 1008, a take longer than FASTSCORE_MAX_DURATION_S or larger than FASTSCORE_MAX_UPLOAD_MB with code 1009.
+    A full pool, or FASTSCORE_LIVE_MAX_SESSIONS sessions already open, closes a new connection with code 1013.
+    """
+    import live  # numpy - ładowany dopiero przy pierwszej sesji na żywo
+
+    global _live_sessions
+    await websocket.accept()
+    try:
+        crepe_pool.check_admission()
+    except PoolBusy as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+    # zadania sesji omijają kolejkę (admit=False) - liczba otwartych sesji jest ograniczona osobno
+    if _live_sessions >= _live_max_sessions:
+        await websocket.close(code=1013, reason=f"Too many live sessions, limit is {_live_max_sessions}")
+        return
+    _live_sessions += 1
+    try:
+        await _live_session(websocket, live)
+    finally:
+        _live_sessions -= 1
+
+async def _live_session(websocket: WebSocket, live):
+    try:
+        decoder = live.AudioDecoder(*live.parse_config(await websocket.receive_json()))
+    except WebSocketDisconnect:
+        return
+    except ValueError as e:
+        await websocket.close(code=1008, reason=f"Invalid config: {e}"[:120])
+        return
+    except KeyError:
+        # pierwsza wiadomość binarna zamiast tekstowej konfiguracji
+        await websocket.close(code=1008, reason="Invalid config: expected a JSON text message")
+        return
+    session = live.LiveTranscription()
+    stopped = asyncio.Event()
+    # close - (kod, powód) zamknięcia po przekroczeniu limitu nagrania lub błędnej wiadomości sterującej
+    state = {"disconnected": False, "received": 0, "close": None}
+
+    async def receive_audio():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    state["disconnected"] = True
+                    return
+                if message.get("bytes"):
+                    state["received"] += len(message["bytes"])
+                    if state["received"] > uploads.MAX_UPLOAD_BYTES:
+                        limit_mb = uploads.MAX_UPLOAD_BYTES // (1024 * 1024)
+                        state["close"] = (1009, f"Recording too large, limit is {limit_mb} MB")
+                        return
+                    await run_in_threadpool(decoder.write, message["bytes"])
+                elif message.get("text"):
+                    try:
+                        control = json.loads(message["text"]).get("type")
+                    except (ValueError, AttributeError):
+                        # nie-JSON albo JSON, który nie jest obiektem - nie kończymy sesji jak po "stop"
+                        state["close"] = (1008, "Invalid control message")
+                        return
+                    if control == "stop":
+                        return
+        finally:
+            stopped.set()
+
+    async def track(final=False):
+        # okna przetwarzane po kolei - przy zajętych workerach kolejne okno obejmuje całe zaległe audio
+        window = session.next_window(final)
+        if window is not None:
+            samples, skip, count = window
+            f0, confidence = await crepe_pool.submit(
+                {"kind": "pitch", "samples": samples, "sample_rate": live.SAMPLE_RATE}, admit=False
+            )
+            session.add_pitch(f0, confidence, skip, count)
+        notes = await run_in_threadpool(session.settle, final)
+        if notes and not state["disconnected"]:
+            await websocket.send_json({"type": "notes", "notes": [
+                {"onset": on, "offset": off, "pitch": pitch, "velocity": velocity}
+                for on, off, pitch, velocity in notes
+            ]})
+
+    receiver = asyncio.create_task(receive_audio())
+    take_path = None
+    try:
+        while not stopped.is_set():
+            try:
+                await asyncio.wait_for(stopped.wait(), timeout=0.25)
+            except asyncio.TimeoutError:
+                pass
+            session.add_audio(decoder.take())
+            if session.duration > uploads.MAX_DURATION_S:
+                state["close"] = (1009, f"Recording too long, limit is {uploads.MAX_DURATION_S:.0f} s")
+                break
+            if session.pending_s() >= session.hop_s:
+                await track()
+        if state["disconnected"]:
+            return
+        if state["close"]:
+            code, reason = state["close"]
+            print(f"Live transcription: {reason}")
+            await websocket.close(code=code, reason=reason)
+            return
+
+        await run_in_threadpool(decoder.finish)
+        session.add_audio(decoder.take())
+        os.makedirs(_upload_dir, exist_ok=True)
+        take_path = os.path.join(_upload_dir, f"live_{uuid.uuid4().hex}.wav")
+        await run_in_threadpool(session.write_wav, take_path)
+        bpm, _ = await asyncio.gather(
+            crepe_pool.submit({"kind": "tempo", "audio_path": take_path}, admit=False),
+            track(final=True),
+        )
+        output_dir = tempfile.mkdtemp(dir=_upload_dir)
+        try:
+            xml_data, midi_bytes = _read_results(*await crepe_pool.submit(
+                {"kind": "score", "notes": session.notes, "bpm": bpm, "output_dir": output_dir}, admit=False
+            ))
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        body, _ = responses.conversion_body("json", xml_data, midi_bytes, fields={"type": "score"})
+        await websocket.send_json(body)
+        await websocket.close()
+    except WebSocketDisconnect:
+        print("Live transcription: client disconnected")
+    except WorkerError as e:
+        print(f"Live transcription worker error: {e}")
+        await websocket.send_json({"type": "error", "detail": "Transcription failed"})
+        await websocket.close(code=1011)
+    finally:
+        receiver.cancel()
+        decoder.close()
+        if take_path and os.path.exists(take_path):
+            os.remove(take_path)
 
 # @app.post("/convert-melody-ext")
-# async def convert_crepe_ext(file: UploadFile = File(...)):
-#     return audio_to_xml(melody_ext_pipe, file)
+# async def convert_crepe_ext(request: Request):
+#     return await audio_to_xml(melody_ext_pool, request)
 
 
 @app.post("/midi-to-audio")
-async def midi_to_audio(midi_file: UploadFile = File(...)):
-    midi_path = Path(midi_file.filename or "upload.mid")
-    with open(midi_path, "wb") as f:
-        shutil.copyfileobj(midi_file.file, f)
-
-    wav_path = midi_path.with_suffix(".wav")
-    fs = FluidSynth("FluidR3_GM.sf2")
-    fs.midi_to_audio(str(midi_path), str(wav_path))
-
-    with open(wav_path, "rb") as f:
-        wav_bytes = f.read()
-    
+async def midi_to_audio(request: Request, midi_file: UploadFile = File(...), format: str = Form("wav")):
+    fmt = format.lower()
+    if fmt not in audio_output.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    media_type = audio_output.media_type(fmt)
+
+    midi_bytes = await midi_file.read()
     try:
-        midi_path.unlink(missing_ok=True)
-        wav_path.unlink(missing_ok=True)
-    except Exception:
-        pass
+        mid = mido.MidiFile(file=BytesIO(midi_bytes))
+    except (OSError, ValueError, EOFError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid midi file: {e}")
+
+    range_header = request.headers.get("range")
+    if range_header is None:
+        # odtwarzanie może ruszyć zanim synteza się skończy
+        chunks = audio_output.encode_iter(synth_pool.render_iter(mid), fmt, synth_pool.sample_rate)
+        # nagłówki są wysyłane przed syntezą - czas renderowania trafia tylko do /metrics
+        return StreamingResponse(
+            _timed_stream(chunks, request.scope["route"].path), media_type=media_type, headers={"Accept-Ranges": "bytes"}
+        )
+
+    # zapytania Range wymagają znanej długości - plik kodujemy w całości i trzymamy w cache; Range służy
+    # wznawianiu pobierania i przewijaniu, fragment nie jest renderowany szybciej niż cały plik
+    timer = timing.StageTimer()
+    key = audio_cache.key(midi_bytes, fmt)
+    data = audio_cache.get(key)
+    if data is None:
+        with timer.stage("render"):
+            data = await run_in_threadpool(
+                lambda: audio_output.encode_bytes(synth_pool.render_iter(mid), fmt, synth_pool.sample_rate)
+            )
+        audio_cache.put(key, data)
+
+    byte_range = audio_output.parse_range(range_header, len(data))
+    if byte_range is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+    start, end = byte_range
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Range": f"bytes {start}-{end}/{len(data)}",
+    }
+    response = Response(content=data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+    return _timed_response(request, response, timer)
+
+def _timed_stream(chunks, endpoint):
+    timer = timing.StageTimer()
+    with timer.stage("render"):
+        yield from chunks
+    metrics.observe_stages(endpoint, timer)
 
-    return Response(content=wav_bytes, media_type="audio/wav")
-    
 @app.post("/xml-to-pdf")
-async def xml_to_pdf(xml: str = Form(...)):
+async def xml_to_pdf(request: Request, xml: str = Form(...)):
     if not xml or not xml.strip():
         raise HTTPException(status_code=400, detail="Empty xml")
-
-    tk = verovio.toolkit()
-    options = {
-        "scale": 80,
-        "footer": "none",
-        "header": "none",
-        "pageHeight": 2970,
-        "pageWidth": 2100,
-        "unit": 10,
-    }
-    tk.setOptions(options)
+    timer = timing.StageTimer()
 
     try:
-        tk.loadData(xml)
-        page_count = tk.getPageCount()
-
-        packet = BytesIO()
-
-        pdf_w, pdf_h = 595.0, 842.0
-        c = canvas.Canvas(packet, pagesize=(pdf_w, pdf_h))
-
-        for page in range(1, page_count + 1):
-            svg = tk.renderToSVG(page)
-            svg = svg.replace("#00000", "#000000")
-            svg = fix_tempo(svg)
-
-            drawing = svg2rlg(BytesIO(svg.encode("utf-8")))
-
-            scale_x = pdf_w / 21000
-            scale_y = pdf_h / 29700
-            scale = min(scale_x, scale_y)
-
-            drawing.scale(scale, scale)
-            offset_y = -drawing.height * scale + pdf_h
-
-            renderPDF.draw(drawing, c, 0, offset_y)
-            c.showPage()
-
-        c.save()
-        packet.seek(0)
-        return Response(content=packet.read(), media_type="application/pdf")
-
+        with timer.stage("render"):
+            pdf = await run_in_threadpool(score_render.render_pdf, xml)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Verovio render error: {e}")
-
-def fix_tempo(svg: str) -> str:
-    svg = re.sub(
-        r'<tspan[^>]*font-family=["\']Leipzig["\'][^>]*font-size=["\']800px["\'][^>]*>.*?</tspan>',
-        '',
-        svg,
-        flags=re.DOTALL
-    )
-
-    svg = re.sub(
-        r'<tspan[^>]*font-size=["\']450px["\'][^>]*>\s*=\s*</tspan>',
-        '',
-        svg,
-        flags=re.DOTALL
-    )
-
-    svg = re.sub(r'<tspan\b[^>]*>\s*</tspan>', '', svg)
-
-    return svg
+    return _timed_response(request, Response(content=pdf, media_type="application/pdf"), timer)
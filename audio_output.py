@@ -0,0 +1,168 @@
+import hashlib
+import re
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+
+from synth import SAMPLE_RATE
+
+_CHUNK_SIZE = 64 * 1024
+
+# format -> (argumenty kodera ffmpeg, typ MIME); None = WAV bez kodowania
+FORMATS = {
+    "wav": (None, "audio/wav"),
+    "flac": (["-c:a", "flac", "-f", "flac"], "audio/flac"),
+    "opus": (["-c:a", "libopus", "-b:a", "64k", "-ar", "48000", "-f", "ogg"], "audio/ogg"),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3"], "audio/mpeg"),
+}
+
+
+def media_type(fmt):
+    return FORMATS[fmt][1]
+
+
+def wav_header(sample_rate=SAMPLE_RATE, channels=2, data_size=None):
+    """
+    Builds a 16-bit PCM WAV header.
+
+    :param data_size: Size of the sample data in bytes, None when unknown (streamed output)
+    :return: Header bytes
+    """
+    if data_size is None:
+        data_size = 0xFFFFFFFF - 36
+    block_align = channels * 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", data_size + 36, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16,
+        b"data", data_size,
+    )
+
+
+def encode_iter(pcm_blocks, fmt, sample_rate=SAMPLE_RATE, channels=2):
+    """
+    Encodes PCM blocks on the fly. Compressed formats are piped through ffmpeg.
+
+    :param pcm_blocks: Iterable of interleaved int16 sample blocks (e.g. SynthPool.render_iter)
+    :param fmt: Output format, one of FORMATS
+    :param sample_rate: Sample rate of the PCM data
+    :param channels: Number of interleaved channels
+    :return: Generator of encoded byte chunks
+    """
+    codec_args, _ = FORMATS[fmt]
+    if codec_args is None:
+        yield wav_header(sample_rate, channels)
+        try:
+            for block in pcm_blocks:
+                yield block.tobytes()
+        finally:
+            if hasattr(pcm_blocks, "close"):
+                pcm_blocks.close()
+        return
+
+    cmd = [
+        "ffmpeg",
+        "-v", "error",
+        "-f", "s16le",
+        "-ar", str(sample_rate),
+        "-ac", str(channels),
+        "-i", "pipe:0",
+        *codec_args,
+        "pipe:1",
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        try:
+            for block in pcm_blocks:
+                proc.stdin.write(block.tobytes())
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            if hasattr(pcm_blocks, "close"):
+                pcm_blocks.close()
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    finished = False
+    try:
+        while chunk := proc.stdout.read1(_CHUNK_SIZE):
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            # klient przerwał odbiór - zatrzymujemy koder
+            proc.kill()
+        writer.join()
+        proc.wait()
+        stderr = proc.stderr.read()
+    if proc.returncode != 0:
+        raise RuntimeError(f"FFmpeg error: {stderr.decode(errors='replace')}")
+
+
+def encode_bytes(pcm_blocks, fmt, sample_rate=SAMPLE_RATE, channels=2):
+    """
+    Encodes PCM blocks into a complete file kept in memory.
+
+    :return: Encoded file bytes
+    """
+    if FORMATS[fmt][0] is None:
+        data = b"".join(block.tobytes() for block in pcm_blocks)
+        return wav_header(sample_rate, channels, len(data)) + data
+    return b"".join(encode_iter(pcm_blocks, fmt, sample_rate, channels))
+
+
+def parse_range(header, size):
+    """
+    Parses a single-range HTTP Range header.
+
+    :param header: Value of the Range header, e.g. "bytes=0-1023"
+    :param size: Full size of the resource in bytes
+    :return: (start, end) inclusive byte positions or None when the header can't be satisfied
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+class EncodedAudioCache:
+    """
+    Small LRU cache of encoded audio, so that Range requests for the same MIDI file don't render it again.
+    """
+
+    def __init__(self, max_items=16):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(midi_bytes, fmt):
+        return hashlib.sha1(midi_bytes).hexdigest(), fmt
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._items[key] = data
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
@@ -8,12 +8,13 @@ def preprocess_audio(
     path: str,
     only_load: bool = False,
     target_sr: int = 16000,
-    target_lufs: float = -23.0
+    target_lufs: float = -23.0,
+    trim_silence: bool = True
 ):
     """
     Preprocessing:
     - load & resample
-    - trim silence
+    - trim silence (unless trim_silence is False, e.g. for a chunk whose onsets must stay aligned)
     - noise reduction
     - LUFS loudness normalization
     - clipping prevention
@@ -46,9 +47,10 @@ def preprocess_audio(
     y = sps.medfilt(y, kernel_size=5)
 
     # === 6. Remove silence ===
-    silence_thresh = 40
-    clips = librosa.effects.split(y, top_db=silence_thresh)
-    y = np.concatenate([y[start:end] for start, end in clips])
+    if trim_silence:
+        silence_thresh = 40
+        clips = librosa.effects.split(y, top_db=silence_thresh)
+        y = np.concatenate([y[start:end] for start, end in clips])
 
     # === Anti clipping ===
     y = np.clip(y, -1.0, 1.0)
@@ -1,16 +1,27 @@
-from basic_pitch.inference import predict_and_save
-from basic_pitch import ICASSP_2022_MODEL_PATH
 from pathlib import Path
 import shutil
-from music21 import converter
 import mido
 
 import notes_tools
+import timing
 
 _output_dir = "basic_pitch_output"
+_model = None
 
-def _generate_midi(audio_path):
-    output_dir = Path(_output_dir)
+def _get_model():
+    # TensorFlow - ładowany dopiero przy pierwszej transkrypcji, model wczytywany raz na proces
+    global _model
+    if _model is None:
+        from basic_pitch.inference import Model
+        from basic_pitch import ICASSP_2022_MODEL_PATH
+        _model = Model(ICASSP_2022_MODEL_PATH)
+    return _model
+
+@timing.timed("inference")
+def _generate_midi(audio_path, output_dir=_output_dir):
+    from basic_pitch.inference import predict_and_save
+
+    output_dir = Path(output_dir)
     if output_dir.exists():
         shutil.rmtree(output_dir)
     output_dir.mkdir()
@@ -21,11 +32,12 @@ def _generate_midi(audio_path):
         sonify_midi=False,       # czy zapisywać podgląd audio z MIDI
         save_model_outputs=False,# czy zapisywać raw output modelu
         save_notes=True,        # czy zapisywać nuty w CSV
-        model_or_model_path=ICASSP_2022_MODEL_PATH # None = domyślny model
+        model_or_model_path=_get_model() # wczytany wcześniej model ICASSP 2022
     )
     midi_path = str(output_dir / f"{Path(audio_path).stem}_basic_pitch.mid")
     return midi_path
 
+@timing.timed("midi")
 def _set_midi_tempo(midi_path, bpm, out_path=None):
     if out_path is None:
         out_path = midi_path
@@ -51,11 +63,50 @@ def _set_midi_tempo(midi_path, bpm, out_path=None):
     return out_path
 
 
-def convert(audio_path, output_filename="output.musicxml"):
-    midi_path = _generate_midi(audio_path)
+def warm_up():
+    """
+    Loads the Basic Pitch model and runs a dummy inference on one second of silence.
+    """
+    import tempfile
+    import numpy as np
+    import soundfile as sf
+    from basic_pitch.inference import predict
+
+    with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+        sf.write(f.name, np.zeros(22050, dtype=np.float32), 22050)
+        predict(f.name, _get_model())
+    notes_tools.warm_up()
+
+@timing.timed("inference")
+def transcribe_notes(audio_path):
+    """
+    Transcribes a recording to note events without writing MIDI / MusicXML.
+
+    :return: List of notes in format: (onset_time, offset_time, midi_val, velocity 0-127), ordered by onset
+    """
+    from basic_pitch.inference import predict
+
+    _, _, note_events = predict(audio_path, _get_model())
+    # zdarzenia: (początek s, koniec s, wysokość MIDI, amplituda 0-1, pitch bend) - głośność jak w MIDI z basic pitch
+    return sorted(
+        (float(start), float(end), float(pitch), float(round(127 * amplitude)))
+        for start, end, pitch, amplitude, _ in note_events
+    )
+
+def convert(audio_path, output_filename="output.musicxml", xml=True, output_dir=None):
+    """
+    :param xml: False skips the MusicXML generation (client only needs the MIDI)
+    :param output_dir: Directory of this job for the MIDI and MusicXML files; by default the shared
+                       basic_pitch_output directory and output_filename in the working directory (one worker only)
+    :return: (path to the MusicXML file or None, path to the MIDI file)
+    """
+    if output_dir is not None:
+        output_filename = str(Path(output_dir) / output_filename)
+    midi_path = _generate_midi(audio_path, output_dir or _output_dir)
     bpm = notes_tools.predict_tempo(audio_path)
     _set_midi_tempo(midi_path, bpm)
-    xml_path = notes_tools.generate_xml(midi_path, output_filename)
+    notes_tools.publish_midi(midi_path, bpm=bpm)
+    xml_path = notes_tools.generate_xml(midi_path, output_filename) if xml else None
     return xml_path, midi_path
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+"""
+Import-time report and startup budget for the service entry points.
+
+    python -m benchmarks.import_time api --budget 3 --forbid tensorflow,crepe,basic_pitch
+    python -m benchmarks.import_time main --cwd functions --budget 5 --forbid tensorflow
+
+Imports the module in a fresh interpreter with `-X importtime`, prints the slowest
+packages and modules and exits with code 1 when the total import time exceeds the budget
+or a forbidden package was imported.
+"""
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def measure(module, cwd=None):
+    """
+    Imports a module in a fresh interpreter and collects its import times.
+
+    :param module: Module name, e.g. "api"
+    :param cwd: Working directory of the interpreter
+    :return: List of (module name, depth, self time [us], cumulative time [us])
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-3000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # wcięcie nazwy oznacza głębokość importu (2 spacje na poziom)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def report(rows, top=15):
+    total_us = sum(cumulative for _, depth, _, cumulative in rows if depth == 0)
+    per_package = defaultdict(int)
+    for name, _, self_us, _ in rows:
+        per_package[name.split(".")[0]] += self_us
+
+    print(f"Total import time: {total_us / 1e6:.2f} s ({len(rows)} modules)")
+    print("\nSlowest packages (self time):")
+    for package, us in sorted(per_package.items(), key=lambda x: -x[1])[:top]:
+        print(f"  {us / 1e3:9.1f} ms  {package}")
+    print("\nSlowest modules (cumulative):")
+    for name, _, _, cumulative in sorted(rows, key=lambda r: -r[3])[:top]:
+        print(f"  {cumulative / 1e3:9.1f} ms  {name}")
+    return total_us / 1e6, set(per_package)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("module", help="module to import, e.g. api")
+    parser.add_argument("--cwd", default=None, help="working directory (e.g. functions)")
+    parser.add_argument("--budget", type=float, default=None, help="startup budget in seconds")
+    parser.add_argument("--forbid", default="", help="comma separated packages that must not be imported")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    total, packages = report(measure(args.module, args.cwd), args.top)
+
+    failed = False
+    if args.budget is not None and total > args.budget:
+        print(f"\nOver budget: {total:.2f} s > {args.budget:.2f} s")
+        failed = True
+    forbidden = {p for p in args.forbid.split(",") if p} & packages
+    if forbidden:
+        print(f"\nForbidden packages imported at startup: {', '.join(sorted(forbidden))}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Load test of a locally started API (uvicorn api:app or the Flask app in functions/main.py).
+
+    uvicorn api:app --port 8000
+    python -m benchmarks.load_test --url http://localhost:8000 --concurrency 4 --duration 120
+    python -m benchmarks.load_test --url http://localhost:8000 --rate 0.5 --duration 300 \\
+        --mix convert-crepe=4,convert-bp=2,xml-to-pdf=2,midi-to-audio=1 --audio-dir my_recordings
+
+Closed loop (--concurrency): N clients send the next request as soon as the previous one finished.
+Open loop (--rate): requests arrive as a Poisson process at the given rate per second regardless of
+how fast the server answers, which is what exposes queueing. Endpoints are drawn from --mix by weight.
+Audio comes from --audio-dir or from a generated synthetic corpus; the MusicXML and MIDI sent to
+xml-to-pdf and midi-to-audio come from the first successful conversion (or --xml / --midi).
+
+Reported per endpoint: throughput, p50/p95/p99 latency of successful requests and error counts by
+status. For the FastAPI app, queue depth is sampled from /ready once per second.
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+_AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip().strip("/")] = float(weight or 1)
+    return mix
+
+
+class LoadTest:
+    def __init__(self, url, audio_paths, mix, timeout, seed=0):
+        self.url = url.rstrip("/")
+        self.audio_paths = audio_paths
+        self.endpoints = list(mix)
+        self.weights = list(mix.values())
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.xml = None
+        self.midi = None
+        self.latencies = defaultdict(list)
+        self.sizes = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.queue_samples = defaultdict(list)
+
+    def _request_args(self, endpoint):
+        if endpoint.startswith("convert-"):
+            path = self.rng.choice(self.audio_paths)
+            with open(path, "rb") as f:
+                return {"files": {"file": (os.path.basename(path), f.read())}}
+        if endpoint == "xml-to-pdf":
+            return {"data": {"xml": self.xml}} if self.xml else None
+        if endpoint == "midi-to-audio":
+            return {"files": {"midi_file": ("score.mid", self.midi)}} if self.midi else None
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+    async def call(self, client, endpoint):
+        args = self._request_args(endpoint)
+        if args is None:
+            # brak XML / MIDI - zastępujemy konwersją, która je dostarczy
+            endpoint = next((e for e in self.endpoints if e.startswith("convert-")), "convert-bp")
+            args = self._request_args(endpoint)
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"{self.url}/{endpoint}", timeout=self.timeout, **args)
+            body = response.content
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status, body = type(e).__name__, b""
+        elapsed = time.perf_counter() - start
+
+        self.statuses[endpoint][status] += 1
+        if status == 200 or status == 206:
+            self.latencies[endpoint].append(elapsed)
+            self.sizes[endpoint].append(len(body))
+            if endpoint.startswith("convert-") and self.xml is None:
+                self._remember_score(response)
+
+    def _remember_score(self, response):
+        try:
+            data = response.json()
+        except ValueError:
+            return
+        if isinstance(data, dict) and data.get("xml"):
+            self.xml = data["xml"]
+            self.midi = base64.b64decode(data.get("midi_base64", "")) or None
+
+    async def sample_queues(self, client, stop):
+        while not stop.is_set():
+            try:
+                response = await client.get(f"{self.url}/ready", timeout=5)
+                for model, status in response.json().get("models", {}).items():
+                    self.queue_samples[model].append((status.get("queued", 0), status.get("running", 0)))
+            except (httpx.HTTPError, ValueError, AttributeError):
+                # np. aplikacja Flask nie ma /ready
+                return
+            await asyncio.sleep(1)
+
+    async def closed_loop(self, client, concurrency, deadline):
+        async def user():
+            while time.monotonic() < deadline:
+                await self.call(client, self.rng.choices(self.endpoints, self.weights)[0])
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+
+    async def open_loop(self, client, rate, deadline, max_outstanding):
+        tasks = set()
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if len(tasks) >= max_outstanding:
+                self.statuses["dropped (client limit)"]["-"] += 1
+                continue
+            task = asyncio.create_task(self.call(client, self.rng.choices(self.endpoints, self.weights)[0]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    async def run(self, duration, concurrency=None, rate=None, max_outstanding=256):
+        limits = httpx.Limits(max_connections=max(concurrency or 0, max_outstanding))
+        async with httpx.AsyncClient(limits=limits) as client:
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(self.sample_queues(client, stop))
+            start = time.monotonic()
+            deadline = start + duration
+            if rate:
+                await self.open_loop(client, rate, deadline, max_outstanding)
+            else:
+                await self.closed_loop(client, concurrency or 1, deadline)
+            elapsed = time.monotonic() - start
+            stop.set()
+            await sampler
+        return elapsed
+
+    def report(self, elapsed):
+        print(f"\nWall time: {elapsed:.1f} s")
+        print(f"{'endpoint':<24} {'ok':>6} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'err %':>6}"
+              f" {'avg KB':>8}  statuses")
+        for endpoint in sorted(self.statuses):
+            counts = self.statuses[endpoint]
+            total = sum(counts.values())
+            latencies = self.latencies[endpoint]
+            errors = total - len(latencies)
+            sizes = self.sizes[endpoint]
+            size = f"{sum(sizes) / len(sizes) / 1024:>8.1f}" if sizes else f"{'-':>8}"
+
+            def fmt(q):
+                value = percentile(latencies, q)
+                return f"{value:>7.2f}" if value is not None else f"{'-':>7}"
+            print(f"{endpoint:<24} {len(latencies):>6} {len(latencies) / elapsed:>7.3f} {fmt(50)} {fmt(95)} {fmt(99)}"
+                  f" {100 * errors / total if total else 0:>6.1f} {size}  {dict(counts)}")
+        for model, samples in self.queue_samples.items():
+            queued = [q for q, _ in samples]
+            running = [r for _, r in samples]
+            print(f"queue {model}: mean {sum(queued) / len(queued):.1f}, max {max(queued)};"
+                  f" running mean {sum(running) / len(running):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=None, help="closed loop with N clients")
+    mode.add_argument("--rate", type=float, default=None, help="open loop, requests per second")
+    parser.add_argument("--max-outstanding", type=int, default=256, help="open loop limit of requests in flight")
+    parser.add_argument("--mix", default="convert-crepe=3,convert-bp=3,xml-to-pdf=2,midi-to-audio=2")
+    parser.add_argument("--audio-dir", default=None, help="directory with audio files, synthetic corpus by default")
+    parser.add_argument("--lengths", default="10,30,60", help="lengths of the synthetic corpus in seconds")
+    parser.add_argument("--xml", default=None, help="MusicXML file for xml-to-pdf")
+    parser.add_argument("--midi", default=None, help="MIDI file for midi-to-audio")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        if args.audio_dir:
+            audio_paths = sorted(
+                os.path.join(args.audio_dir, f) for f in os.listdir(args.audio_dir)
+                if f.lower().endswith(_AUDIO_EXTENSIONS)
+            )
+        else:
+            from benchmarks import synthetic
+            audio_paths = synthetic.write_corpus(corpus_dir, [int(x) for x in args.lengths.split(",")], args.seed)
+        if not audio_paths:
+            raise SystemExit("No audio files")
+
+        test = LoadTest(args.url, audio_paths, parse_mix(args.mix), args.timeout, args.seed)
+        if args.xml:
+            with open(args.xml, encoding="utf-8") as f:
+                test.xml = f.read()
+        if args.midi:
+            with open(args.midi, "rb") as f:
+                test.midi = f.read()
+        elapsed = asyncio.run(test.run(args.duration, args.concurrency, args.rate, args.max_outstanding))
+    test.report(elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Stage timings and transcription accuracy of the CREPE pipeline on the synthetic corpus.
+
+    python -m benchmarks.pipeline --lengths 10,30,60 --repeat 3 --out bench_results.json
+    python -m benchmarks.pipeline --lengths 10,30,60 --baseline bench_results.json --max-f1-drop 0.02
+
+The corpus (benchmarks/synthetic.py) is generated into a temporary directory unless --corpus is given.
+Each file goes through preprocess_audio, predict_tempo, crepe.predict, generate_notes, save_notes_to_midi,
+generate_xml, PDF rendering and WAV synthesis; every stage is timed separately (median of --repeat runs,
+after one warm-up). Note accuracy is measured with mir_eval against the known notes: F1 of onsets
+(50 ms tolerance) and of onsets + offsets, plus the tempo error.
+
+With --baseline the results are compared to an earlier --out file and the script exits with code 1
+when the F1 of any file dropped by more than --max-f1-drop, so speed work can't quietly cost accuracy.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+
+from benchmarks import synthetic
+
+STAGES = (
+    "preprocess_audio", "predict_tempo", "crepe.predict", "generate_notes",
+    "save_notes_to_midi", "generate_xml", "render_pdf", "render_wav",
+)
+
+
+def note_accuracy(reference, estimated, onset_tolerance=0.05):
+    """
+    :param reference: Ground truth notes [(onset s, offset s, MIDI pitch)]
+    :param estimated: Transcribed notes [(onset s, offset s, MIDI pitch, ...)]
+    :return: Dict with onset and onset+offset precision / recall / F1
+    """
+    import numpy as np
+    import mir_eval
+
+    def arrays(notes):
+        if not notes:
+            return np.zeros((0, 2)), np.zeros(0)
+        intervals = np.array([[n[0], n[1]] for n in notes], dtype=float)
+        pitches = mir_eval.util.midi_to_hz(np.array([n[2] for n in notes], dtype=float))
+        return intervals, pitches
+
+    ref_intervals, ref_pitches = arrays(reference)
+    est_intervals, est_pitches = arrays(estimated)
+    result = {}
+    for name, offset_ratio in (("onset", None), ("note", 0.2)):
+        p, r, f, _ = mir_eval.transcription.precision_recall_f1_overlap(
+            ref_intervals, ref_pitches, est_intervals, est_pitches,
+            onset_tolerance=onset_tolerance, offset_ratio=offset_ratio,
+        )
+        result[f"{name}_precision"], result[f"{name}_recall"], result[f"{name}_f1"] = (
+            round(float(p), 4), round(float(r), 4), round(float(f), 4)
+        )
+    return result
+
+
+def run_file(wav_path, workdir, synth_pool=None, preprocessing=False):
+    """
+    Runs the pipeline once on a file.
+
+    :return: (stage durations dict, transcribed notes, detected tempo)
+    """
+    import crepe
+
+    import audio_preprocessing
+    import notes_tools
+    import score_render
+    import timing
+
+    timer = timing.StageTimer()
+    with timer.stage("preprocess_audio"):
+        # bez wycinania ciszy - nuty muszą zostać na swoich miejscach względem nut wzorcowych
+        y, sr = audio_preprocessing.preprocess_audio(wav_path, only_load=not preprocessing, trim_silence=False)
+    with timer.stage("predict_tempo"):
+        bpm = notes_tools.predict_tempo(wav_path)
+    with timer.stage("crepe.predict"):
+        time_axis, f0, confidence, _ = crepe.predict(y, sr, viterbi=True, verbose=0)
+    with timer.stage("generate_notes"):
+        notes = notes_tools.generate_notes(y, sr, time_axis, f0, confidence, 0.01)
+    with timer.stage("save_notes_to_midi"):
+        midi_path = notes_tools.save_notes_to_midi(notes, os.path.join(workdir, "midi"), bpm=bpm)
+    with timer.stage("generate_xml"):
+        xml_path = notes_tools.generate_xml(str(midi_path), os.path.join(workdir, "output.musicxml"))
+    if synth_pool is not None:
+        with open(xml_path, encoding="utf-8") as f:
+            xml = f.read()
+        with timer.stage("render_pdf"):
+            score_render.render_pdf(xml)
+        with timer.stage("render_wav"):
+            synth_pool.render_wav(str(midi_path))
+    return timer.stages, notes, bpm
+
+
+def benchmark(paths, repeat=3, render=True, preprocessing=False):
+    import crepe_convert
+    import synth
+
+    crepe_convert.warm_up()
+    synth_pool = synth.SynthPool(synth.find_soundfont("FluidR3_GM.sf2"), size=1) if render else None
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if paths:
+            # rozgrzewka renderowania i pierwszego przebiegu, nie wliczana do wyników
+            run_file(paths[0], workdir, synth_pool, preprocessing)
+        for path in paths:
+            truth = synthetic.load_truth(path)
+            runs = []
+            for _ in range(repeat):
+                stages, notes, bpm = run_file(path, workdir, synth_pool, preprocessing)
+                runs.append(stages)
+            duration = truth["notes"][-1][1] + 0.5 if truth["notes"] else 0.0
+            medians = {s: round(statistics.median(r[s] for r in runs), 4) for s in STAGES if s in runs[0]}
+            total = sum(medians.values())
+            results.append({
+                "file": os.path.basename(path),
+                "duration_s": round(duration, 2),
+                "stages_s": medians,
+                "total_s": round(total, 3),
+                "realtime_factor": round(total / duration, 3) if duration else None,
+                "notes_reference": len(truth["notes"]),
+                "notes_estimated": len(notes),
+                "tempo_reference": truth["bpm"],
+                "tempo_estimated": bpm,
+                **note_accuracy(truth["notes"], notes),
+            })
+    if synth_pool is not None:
+        synth_pool.close()
+    return results
+
+
+def print_results(results):
+    stages = [s for s in STAGES if any(s in r["stages_s"] for r in results)]
+    print(f"{'file':<26} {'len s':>6} " + " ".join(f"{s:>18}" for s in stages) + f" {'total':>8} {'x RT':>6}")
+    for r in results:
+        print(f"{r['file']:<26} {r['duration_s']:>6} "
+              + " ".join(f"{r['stages_s'].get(s, 0):>18.3f}" for s in stages)
+              + f" {r['total_s']:>8.2f} {r['realtime_factor']:>6}")
+    print(f"\n{'file':<26} {'notes':>11} {'onset F1':>9} {'note F1':>8} {'tempo':>9}")
+    for r in results:
+        print(f"{r['file']:<26} {r['notes_estimated']:>5}/{r['notes_reference']:<5} {r['onset_f1']:>9}"
+              f" {r['note_f1']:>8} {r['tempo_estimated']:>4}/{r['tempo_reference']:<4}")
+
+
+def compare(results, baseline, max_f1_drop):
+    """
+    Prints speed and accuracy changes against a baseline.
+
+    :return: True if no file lost more than max_f1_drop of F1
+    """
+    previous = {r["file"]: r for r in baseline}
+    ok = True
+    print("\nChange against baseline:")
+    for r in results:
+        old = previous.get(r["file"])
+        if old is None:
+            continue
+        speedup = old["total_s"] / r["total_s"] if r["total_s"] else float("inf")
+        drops = {k: old[k] - r[k] for k in ("onset_f1", "note_f1")}
+        regressed = any(d > max_f1_drop for d in drops.values())
+        ok = ok and not regressed
+        print(f"  {r['file']:<26} speed x{speedup:.2f}, onset F1 {-drops['onset_f1']:+.3f},"
+              f" note F1 {-drops['note_f1']:+.3f}{'  <-- accuracy regression' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=None, help="directory with an existing corpus")
+    parser.add_argument("--lengths", default="10,30,60")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--preprocessing", action="store_true", help="run the full preprocessing")
+    parser.add_argument("--no-render", action="store_true", help="skip PDF and WAV rendering")
+    parser.add_argument("--out", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="earlier --out file to compare against")
+    parser.add_argument("--max-f1-drop", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        if args.corpus:
+            paths = sorted(os.path.join(args.corpus, f) for f in os.listdir(args.corpus) if f.endswith(".wav"))
+        else:
+            lengths = [int(x) for x in args.lengths.split(",")]
+            paths = synthetic.write_corpus(corpus_dir, lengths, args.seed)
+        results = benchmark(paths, args.repeat, render=not args.no_render, preprocessing=args.preprocessing)
+
+    print_results(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_f1_drop):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
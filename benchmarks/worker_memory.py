@@ -0,0 +1,98 @@
+"""
+Per-worker memory of the model pools with different start methods.
+
+    python -m benchmarks.worker_memory --workers 3
+    python -m benchmarks.worker_memory --workers 3 --modes fork,forkserver --preload-weights
+
+Each mode runs in a separate interpreter (the fork server and its preload are per process).
+Workers are started, warmed up, and then measured with psutil:
+RSS counts shared pages in every process, USS is memory unique to the worker,
+PSS splits shared pages between the processes sharing them. USS/PSS show what fork-server
+preloading actually saves.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_MODELS = ("crepe", "basic_pitch")
+
+
+def measure_mode(mode, model, workers_count):
+    """
+    Starts a pool in this interpreter and measures its workers.
+
+    :return: Dict with per-worker memory in MB
+    """
+    import psutil
+
+    import workers
+    from worker_pool import ModelPool, configure_forkserver
+
+    target = workers.crepe_worker if model == "crepe" else workers.basic_pitch_worker
+    if mode == "forkserver":
+        configure_forkserver(["model_preload"])
+    pool = ModelPool(model, target, size=workers_count, start_method=mode)
+    pool.start()
+    try:
+        if not pool.wait_ready(timeout=600):
+            raise RuntimeError("workers did not become ready")
+        rows = []
+        for worker in pool.workers:
+            mem = psutil.Process(worker.process.pid).memory_full_info()
+            rows.append({
+                "pid": worker.process.pid,
+                "rss_mb": round(mem.rss / 2**20, 1),
+                "uss_mb": round(mem.uss / 2**20, 1),
+                "pss_mb": round(getattr(mem, "pss", 0) / 2**20, 1),
+                "warm": worker.info.get("warm"),
+                "warmup_s": worker.info.get("warmup_s"),
+            })
+        return {"mode": mode, "model": model, "workers": rows}
+    finally:
+        pool.stop()
+
+
+def print_result(result):
+    rows = result["workers"]
+    print(f"\n{result['model']} / {result['mode']} ({len(rows)} workers)")
+    print(f"  {'pid':>8} {'RSS MB':>9} {'USS MB':>9} {'PSS MB':>9} {'warm-up s':>10}")
+    for r in rows:
+        print(f"  {r['pid']:>8} {r['rss_mb']:>9} {r['uss_mb']:>9} {r['pss_mb']:>9} {r['warmup_s']:>10}")
+    n = len(rows) or 1
+    print(f"  {'mean':>8} {sum(r['rss_mb'] for r in rows) / n:>9.1f} {sum(r['uss_mb'] for r in rows) / n:>9.1f}"
+          f" {sum(r['pss_mb'] for r in rows) / n:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--models", default=",".join(_MODELS))
+    parser.add_argument("--modes", default="fork,spawn,forkserver")
+    parser.add_argument("--preload-weights", action="store_true", help="load weights in the fork server too")
+    parser.add_argument("--single", nargs=2, metavar=("MODE", "MODEL"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        mode, model = args.single
+        print(json.dumps(measure_mode(mode, model, args.workers)))
+        return
+
+    env = dict(os.environ)
+    if args.preload_weights:
+        env["FASTSCORE_PRELOAD_WEIGHTS"] = "1"
+    for model in args.models.split(","):
+        for mode in args.modes.split(","):
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.worker_memory", "--workers", str(args.workers), "--single", mode, model],
+                env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"\n{model} / {mode} failed:\n{proc.stderr[-2000:]}")
+                continue
+            print_result(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Throughput of a model pool for different worker counts and thread budgets.
+
+    python -m benchmarks.worker_threads --audio test_music/sample.wav --grid 1x4,2x2,4x1 --jobs 16
+    python -m benchmarks.worker_threads --audio test_music/sample.wav --models crepe --grid 2x2,2x4 --pin
+
+Every "WORKERSxTHREADS" configuration runs in a separate interpreter: a pool is started with that
+many workers and threads per worker (optionally pinned to their own cores, see assign_cpus), warmed up,
+and then fed `--jobs` transcriptions of the same file with all workers busy. Reported are jobs per
+minute and the median / p95 latency of a single job.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_MODELS = ("crepe", "basic_pitch")
+
+
+def measure_config(model, workers_count, threads, audio, jobs, pin):
+    """
+    Starts a pool in this interpreter and runs the jobs through it.
+
+    :return: Dict with throughput and latencies
+    """
+    import workers
+    from worker_pool import ModelPool, WorkerError, assign_cpus
+
+    target = workers.crepe_worker if model == "crepe" else workers.basic_pitch_worker
+    cpus = assign_cpus([(workers_count, threads)])[0] if pin else None
+    pool = ModelPool(model, target, size=workers_count, threads=threads, cpus=cpus)
+    pool.start()
+    try:
+        if not pool.wait_ready(timeout=600):
+            raise RuntimeError("workers did not become ready")
+
+        def job(_):
+            # każde zadanie we własnym katalogu wyjściowym, jak w api.py - równoległe workery nie kasują
+            # sobie nawzajem plików
+            output_dir = tempfile.mkdtemp(prefix="worker_threads_")
+            start = time.perf_counter()
+            try:
+                pool.run({"audio_path": audio, "output_dir": output_dir})
+                ok = True
+            except WorkerError:
+                ok = False
+            finally:
+                elapsed = time.perf_counter() - start
+                shutil.rmtree(output_dir, ignore_errors=True)
+            return ok, elapsed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers_count) as executor:
+            results = list(executor.map(job, range(jobs)))
+        wall = time.perf_counter() - start
+    finally:
+        pool.stop()
+
+    latencies = sorted(t for ok, t in results if ok)
+    return {
+        "model": model,
+        "workers": workers_count,
+        "threads": threads,
+        "jobs_per_min": round(len(latencies) / wall * 60, 2),
+        "p50_s": round(statistics.median(latencies), 2) if latencies else None,
+        "p95_s": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else None,
+        "errors": len(results) - len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", required=True, help="audio file transcribed by every job")
+    parser.add_argument("--models", default=",".join(_MODELS))
+    parser.add_argument("--grid", default=f"1x{os.cpu_count()},2x{max(1, os.cpu_count() // 2)}",
+                        help="comma separated WORKERSxTHREADS configurations")
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--pin", action="store_true", help="pin every worker to its own cores")
+    parser.add_argument("--single", nargs=3, metavar=("MODEL", "WORKERS", "THREADS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        model, workers_count, threads = args.single
+        result = measure_config(model, int(workers_count), int(threads), args.audio, args.jobs, args.pin)
+        print(json.dumps(result))
+        return
+
+    print(f"{'model':<12} {'workers':>7} {'threads':>7} {'jobs/min':>9} {'p50 s':>7} {'p95 s':>7} {'errors':>6}")
+    for model in args.models.split(","):
+        for config in args.grid.split(","):
+            workers_count, threads = config.lower().split("x")
+            cmd = [sys.executable, "-m", "benchmarks.worker_threads", "--audio", args.audio, "--jobs", str(args.jobs),
+                   "--single", model, workers_count, threads]
+            if args.pin:
+                cmd.append("--pin")
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{model} {config} failed:\n{proc.stderr[-2000:]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{r['model']:<12} {r['workers']:>7} {r['threads']:>7} {r['jobs_per_min']:>9} {r['p50_s']:>7}"
+                  f" {r['p95_s']:>7} {r['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import asyncio
+
+# Łączenie identycznych konwersji w toku (single-flight): gdy to samo nagranie z tymi samymi opcjami
+# trafi na ten sam model, zanim poprzednia konwersja się skończyła (podwójne kliknięcie, cała klasa
+# wysyła ten sam podkład), kolejne żądania czekają na wynik pierwszej zamiast uruchamiać własną inferencję.
+# Wynik nie jest zapamiętywany po zakończeniu - to nie jest cache.
+
+
+class _Flight:
+    def __init__(self, owner):
+        self.owner = owner
+        self.task = None
+        self.checks = []
+
+    async def all_disconnected(self):
+        # zadanie przerywamy dopiero, gdy odeszli wszyscy czekający klienci
+        for check in list(self.checks):
+            if check is None or not await check():
+                return False
+        return True
+
+
+class SingleFlight:
+    """
+    Runs at most one conversion per key; callers with the same key attach to the running one.
+    Must be used from the event loop.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def owner(self, key):
+        """
+        :return: Owner (e.g. job ID) of the conversion in flight for the key, None if there is none
+        """
+        flight = self._flights.get(key)
+        return flight.owner if flight is not None else None
+
+    def _done(self, key, task):
+        self._flights.pop(key, None)
+        # wyjątek odczytany także wtedy, gdy nikt już nie czeka na wynik (bez ostrzeżenia asyncio)
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, factory, is_disconnected=None, owner=None):
+        """
+        :param key: Hashable key of identical conversions
+        :param factory: Coroutine function taking an is_disconnected coroutine function (see ModelPool.submit)
+                        that is true once every attached caller has gone away
+        :param is_disconnected: This caller's is_disconnected, None = never gives up (e.g. a background job)
+        :param owner: Identifies the caller that starts the conversion, see owner()
+        :return: (result, shared) - shared is True when the result came from a conversion started by another caller
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = self._flights[key] = _Flight(owner)
+            flight.task = asyncio.ensure_future(factory(flight.all_disconnected))
+            flight.task.add_done_callback(lambda task: self._done(key, task))
+        flight.checks.append(is_disconnected)
+        try:
+            # shield - anulowanie jednego z czekających nie przerywa konwersji pozostałych
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.checks.remove(is_disconnected)
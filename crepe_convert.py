@@ -1,27 +1,201 @@
-import crepe
+import os
+
 import notes_tools
 import audio_preprocessing
+import timing
 
 _output_dir = "crepe_output"
+_sample_rate = 16000
+# długość bloku ramek CREPE między kolejnymi raportami postępu (100 ramek = 1 s audio)
+_progress_block_frames = 3000
+
+def _predict_with_progress(y, sr, step_size=10):
+    """
+    Same as crepe.predict(y, sr, viterbi=True), but the activation is computed in blocks of frames and
+    the share of finished frames is reported with timing.progress("inference", ...).
+    """
+    import numpy as np
+    import crepe
+
+    hop = sr * step_size // 1000
+    # ramki jak w crepe.core.get_activation(center=True): wyrównanie o pół okna (512 próbek)
+    padded = np.pad(y, 512, mode="constant", constant_values=0)
+    n_frames = 1 + (len(padded) - 1024) // hop
+    blocks = []
+    for first in range(0, n_frames, _progress_block_frames):
+        last = min(n_frames, first + _progress_block_frames)
+        block = padded[first * hop:(last - 1) * hop + 1024]
+        blocks.append(crepe.core.get_activation(block, sr, center=False, step_size=step_size, verbose=0))
+        timing.progress("inference", last / n_frames)
+    activation = np.concatenate(blocks)
+
+    confidence = activation.max(axis=1)
+    cents = crepe.core.to_viterbi_cents(activation)
+    frequency = 10 * 2 ** (cents / 1200)
+    frequency[np.isnan(frequency)] = 0
+    time = np.arange(confidence.shape[0]) * step_size / 1000.0
+    return time, frequency, confidence, activation
+
+def _audio_to_notes_crepe(y, sr):
+    import crepe  # TensorFlow - ładowany dopiero przy pierwszej transkrypcji
 
-def _audio_to_midi_crepe(y, sr, bpm):
     print(f"Audio załadowane: {len(y)/sr:.2f} s, {sr} Hz")
-    time, f0, confidence, activation = crepe.predict(y, sr, viterbi=True)
+    with timing.stage("inference"):
+        if timing.reporting() and sr == _sample_rate:
+            time, f0, confidence, activation = _predict_with_progress(y, sr)
+        else:
+            time, f0, confidence, activation = crepe.predict(y, sr, viterbi=True)
     print("CREPE zakończony:", len(f0), "ramek")
     time_step = 0.01
 
-    notes = notes_tools.generate_notes(y, sr, time, f0, confidence, time_step)
-    return notes_tools.save_notes_to_midi(notes, _output_dir, bpm=bpm)
+    return notes_tools.generate_notes(y, sr, time, f0, confidence, time_step)
+
+def _audio_to_midi_crepe(y, sr, bpm, output_dir=_output_dir):
+    notes = _audio_to_notes_crepe(y, sr)
+    midi_path = notes_tools.save_notes_to_midi(notes, output_dir, bpm=bpm)
+    notes_tools.publish_midi(midi_path, notes, bpm)
+    return midi_path
 
 # ------------------------------------------------
 # Metody publiczne:
 # ------------------------------------------------
 
-def convert(audio_path, preprocessing=False, output_filename="output.musicxml"):
-    y, sr = audio_preprocessing.preprocess_audio(audio_path, only_load= not preprocessing)
+def warm_up():
+    """
+    Loads the CREPE model and runs a dummy inference, so that the first request doesn't pay for loading and graph tracing.
+    """
+    import numpy as np
+    import crepe
+
+    crepe.predict(np.zeros(16000, dtype=np.float32), 16000, viterbi=True, verbose=0)
+    notes_tools.warm_up()
+
+def convert(audio_path, preprocessing=False, output_filename="output.musicxml", xml=True, output_dir=None):
+    """
+    :param xml: False skips the MusicXML generation (client only needs the MIDI)
+    :param output_dir: Directory of this job for the MIDI and MusicXML files; by default the shared crepe_output
+                       directory and output_filename relative to the working directory (one worker only)
+    :return: (path to the MusicXML file or None, path to the MIDI file)
+    """
+    if output_dir is not None:
+        output_filename = os.path.join(output_dir, output_filename)
+    with timing.stage("preprocessing" if preprocessing else "load"):
+        y, sr = audio_preprocessing.preprocess_audio(audio_path, only_load= not preprocessing)
     bpm = notes_tools.predict_tempo(audio_path)
-    midi_path = _audio_to_midi_crepe(y, sr, bpm)
-    xml_path = notes_tools.generate_xml(midi_path, output_filename)
+    midi_path = _audio_to_midi_crepe(y, sr, bpm, output_dir or _output_dir)
+    xml_path = notes_tools.generate_xml(midi_path, output_filename) if xml else None
+    return xml_path, midi_path
+
+# ------------------------------------------------
+# Transkrypcja długich nagrań w częściach (równolegle na kilku workerach):
+# split_at_silence -> transcribe_notes dla każdej części + predict_tempo -> notes_to_score
+# ------------------------------------------------
+
+def _quietest_cut(y, sr, start, end, min_chunk_s, max_chunk_s, frame=512):
+    """
+    Position of the quietest frame in y[start:end] that leaves at least min_chunk_s on both sides
+    and at most max_chunk_s before it.
+    """
+    import librosa
+    import numpy as np
+
+    low = start + int(min_chunk_s * sr)
+    high = min(start + int(max_chunk_s * sr), end - int(min_chunk_s * sr))
+    rms = librosa.feature.rms(y=y[low:high], frame_length=2 * frame, hop_length=frame, center=False)[0]
+    return low + int(np.argmin(rms)) * frame + frame
+
+def split_at_silence(audio_path, chunk_dir, parts, min_duration=120.0, min_chunk_s=30.0, max_chunk_s=180.0,
+                     top_db=40):
+    """
+    Splits a long recording into chunks cut in the middle of silent gaps (like the silence removal
+    in preprocess_audio), so that the chunks can be transcribed independently.
+
+    :param audio_path: Path to the recording
+    :param chunk_dir: Directory for the chunk WAV files
+    :param parts: Desired number of chunks (e.g. number of workers), chunks are never shorter than min_chunk_s
+                  nor longer than max_chunk_s
+    :param min_duration: Recordings shorter than this are not split
+    :param max_chunk_s: Chunks without any silent gap this long are cut at their quietest frame before this length
+    :param top_db: Threshold below the peak considered silence
+    :return: List of (chunk path, offset of the chunk in seconds); [(audio_path, 0.0)] when not split
+    """
+    import librosa
+    import soundfile as sf
+
+    y, sr = librosa.load(audio_path, sr=_sample_rate)
+    duration = len(y) / sr
+    if duration < max(min_duration, 2 * min_chunk_s):
+        return [(audio_path, 0.0)]
+    target = min(max_chunk_s, max(min_chunk_s, duration / parts))
+
+    # cięcia w środku przerw między fragmentami z dźwiękiem, gdy bieżąca część osiągnęła docelową długość
+    intervals = librosa.effects.split(y, top_db=top_db)
+    cuts = [0]
+    for (_, gap_start), (gap_end, _) in zip(intervals[:-1], intervals[1:]):
+        middle = (gap_start + gap_end) // 2
+        if (middle - cuts[-1]) / sr >= target and (len(y) - middle) / sr >= min_chunk_s:
+            cuts.append(middle)
+    cuts.append(len(y))
+
+    bounds = []
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        # brak przerwy w dźwięku przez dłuższy czas - cięcie w najcichszym miejscu przed limitem długości
+        while (end - start) / sr > max_chunk_s:
+            cut = _quietest_cut(y, sr, start, end, min_chunk_s, max_chunk_s)
+            bounds.append((start, cut))
+            start = cut
+        bounds.append((start, end))
+    if len(bounds) == 1:
+        return [(audio_path, 0.0)]
+
+    os.makedirs(chunk_dir, exist_ok=True)
+    chunks = []
+    for i, (start, end) in enumerate(bounds):
+        path = os.path.join(chunk_dir, f"chunk_{i:03d}.wav")
+        sf.write(path, y[start:end], sr)
+        chunks.append((path, start / sr))
+    print(f"Podzielono {duration:.1f} s na {len(chunks)} części")
+    return chunks
+
+def transcribe_notes(audio_path, preprocessing=False, trim_silence=True):
+    """
+    Transcribes a recording (or a chunk of one) to notes without writing MIDI / MusicXML.
+
+    :param trim_silence: False keeps the silence in preprocessing, so that onsets stay relative to the start
+                         of the file (chunks of a split recording are stitched by their offsets)
+    :return: List of notes in format: (onset_time, offset_time, midi_val, amplitude)
+    """
+    with timing.stage("preprocessing" if preprocessing else "load"):
+        y, sr = audio_preprocessing.preprocess_audio(
+            audio_path, only_load= not preprocessing, trim_silence=trim_silence
+        )
+    return [tuple(float(v) for v in note) for note in _audio_to_notes_crepe(y, sr)]
+
+def pitch_track(y, sr=_sample_rate):
+    """
+    CREPE pitch of one audio window (live transcription, see live.py).
+
+    :return: (f0, confidence) per 10 ms frame
+    """
+    import crepe
+
+    with timing.stage("inference"):
+        _, f0, confidence, _ = crepe.predict(y, sr, viterbi=True, verbose=0)
+    return f0, confidence
+
+def notes_to_score(notes, bpm, output_filename="output.musicxml", xml=True, output_dir=None):
+    """
+    Writes notes (e.g. stitched from transcribed chunks) to MIDI and MusicXML.
+
+    :param xml: False skips the MusicXML generation
+    :param output_dir: Directory of this job for the output files, see convert()
+    :return: (path to the MusicXML file or None, path to the MIDI file)
+    """
+    if output_dir is not None:
+        output_filename = os.path.join(output_dir, output_filename)
+    midi_path = notes_tools.save_notes_to_midi(notes, output_dir or _output_dir, bpm=bpm)
+    notes_tools.publish_midi(midi_path, notes, bpm)
+    xml_path = notes_tools.generate_xml(midi_path, output_filename) if xml else None
     return xml_path, midi_path
 
 if __name__ == "__main__":
@@ -1,14 +1,15 @@
 import shutil
 import tempfile
 import os
-from basic_pitch.inference import predict_and_save
-from basic_pitch import ICASSP_2022_MODEL_PATH
 from pathlib import Path
-from music21 import converter
 
 
 def generate_midi(audio_path):
     """Generate MIDI file from audio using Basic Pitch"""
+    # Imported on first use, loads TensorFlow
+    from basic_pitch.inference import predict_and_save
+    from basic_pitch import ICASSP_2022_MODEL_PATH
+
     output_dir = Path(tempfile.gettempdir()) / "basic_pitch_output"
     
     if output_dir.exists():
@@ -31,6 +32,8 @@ def generate_midi(audio_path):
 
 def convert(audio_path):
     """Convert audio file to MusicXML format"""
+    from music21 import converter
+
     midi_path = generate_midi(audio_path)
     score = converter.parse(midi_path)
     
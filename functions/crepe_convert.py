@@ -1,10 +1,11 @@
-import crepe
 import notes_tools
 import audio_preprocessing
 
 _output_dir = "crepe_output"
 
 def _audio_to_midi_crepe(y, sr, bpm):
+    import crepe  # TensorFlow - ładowany dopiero przy pierwszej transkrypcji
+
     print(f"Audio załadowane: {len(y)/sr:.2f} s, {sr} Hz")
     time, f0, confidence, activation = crepe.predict(y, sr, viterbi=True)
     print("CREPE zakończony:", len(f0), "ramek")
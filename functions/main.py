@@ -1,20 +1,11 @@
 from flask import Flask, request, jsonify, send_file, Response
+from werkzeug.exceptions import RequestedRangeNotSatisfiable, RequestEntityTooLarge
 import tempfile
 import os
-import shutil
 import logging
-import uuid
 import datetime
-from firebase_admin import initialize_app, storage, credentials, firestore
-import google.auth
-from google.auth import iam
-from google.auth import impersonated_credentials
-from google.auth.transport import requests as google_requests
-import google.auth.credentials
-import subprocess
-from pathlib import Path
-import base64
-from midi2audio import FluidSynth
+from firebase_admin import initialize_app, firestore
+import threading
 from svglib.svglib import svg2rlg
 from reportlab.pdfgen import canvas
 from reportlab.graphics import renderPDF
@@ -22,6 +13,13 @@ import verovio
 from io import BytesIO
 import importlib.util
 import mido
+import synth
+import audio_output
+import responses
+import uploads
+import storage_backend
+import persistence
+import atexit
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
@@ -36,38 +34,46 @@ except ValueError:
     pass
 
 app = Flask(__name__)
+# Reject oversized requests from Content-Length before the body is read
+app.config['MAX_CONTENT_LENGTH'] = uploads.MAX_UPLOAD_BYTES + 1024 * 1024
+
+_upload_dir = os.path.join(tempfile.gettempdir(), "uploads")
+
+# Artifact storage (Firebase Storage by default, see storage_backend.create_backend).
+# Credentials and the URL signer are resolved once per instance, on first use.
+artifact_storage = storage_backend.create_backend()
+persistence_queue = persistence.PersistenceQueue(artifact_storage)
+atexit.register(persistence_queue.join, 10)
+
+# Soundfont installed in the Docker image, loaded once per instance by the synth pool
+_synth_pool = None
+_synth_pool_lock = threading.Lock()
+
+def get_synth_pool():
+    global _synth_pool
+    with _synth_pool_lock:
+        if _synth_pool is None:
+            soundfont_path = synth.find_soundfont("/usr/share/sounds/sf2/FluidR3_GM.sf2")
+            logger.info(f"Using soundfont: {soundfont_path}")
+            # Same settings as the former fluidsynth CLI call: gain 1.0, reverb and chorus off
+            _synth_pool = synth.SynthPool(soundfont_path, gain=1.0, reverb=False, chorus=False)
+        return _synth_pool
+
+_audio_cache = audio_output.EncodedAudioCache()
+
+def _preload_models(module_names):
+    for name in module_names:
+        try:
+            importlib.import_module(name)
+            logger.info(f"Preloaded {name}")
+        except Exception as e:
+            logger.error(f"Preloading {name} failed: {e}")
 
-def convert_opus_to_wav(input_path, timeout=10):
-    input_path = Path(input_path)
-    output_path = input_path.with_suffix(".wav")
-
-    cmd = [
-        "ffmpeg",
-        "-nostdin",
-        "-y",
-        "-v", "error",
-        "-i", str(input_path),
-        "-ac", "1",
-        "-ar", "44100",
-        str(output_path)
-    ]
-
-    try:
-        subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=timeout,
-            check=True
-        )
-    except subprocess.TimeoutExpired:
-        print("FFmpeg timeout — proces zawiesił się.")
-        raise
-    except subprocess.CalledProcessError as e:
-        print("FFmpeg error:", e.stderr.decode())
-        raise
-
-    return str(output_path)
+# Optional background import of the model modules, e.g. FASTSCORE_PRELOAD_MODELS=crepe_convert,basic_pitch_convert.
+# Off by default, so an instance serving only /xml-to-pdf and /midi-to-audio never loads TensorFlow.
+_preload = [name for name in os.environ.get('FASTSCORE_PRELOAD_MODELS', '').split(',') if name]
+if _preload:
+    threading.Thread(target=_preload_models, args=(_preload,), daemon=True).start()
 
 def process_audio_request(model_type='basic_pitch', preprocessing=False):
     if request.method == 'OPTIONS':
@@ -87,9 +93,6 @@ def process_audio_request(model_type='basic_pitch', preprocessing=False):
         return ('Method not allowed', 405, headers)
     
     try:
-        import basic_pitch_convert
-        import crepe_convert
-        
         if 'file' not in request.files:
             return ('No file provided', 400, headers)
         
@@ -111,110 +114,54 @@ def process_audio_request(model_type='basic_pitch', preprocessing=False):
         image_url = request.form.get('imageUrl')
         image_asset = request.form.get('imageAsset')
 
-        temp_dir = tempfile.mkdtemp()
-        original_filename = uploaded_file.filename or "audio.mp3"
-        audio_file_path = os.path.join(temp_dir, original_filename)
-        uploaded_file.save(audio_file_path)
-        
-        # Handle .opus or other formats that need conversion
-        if original_filename.lower().endswith('.opus'):
-             logger.info("Detected .opus file, converting to .wav")
-             audio_file_path = convert_opus_to_wav(audio_file_path)
+        original_filename = os.path.basename(uploaded_file.filename or "audio.mp3")
+        # Size/duration limits are checked while copying, .opus files are decoded to .wav on the fly
+        # The SHA-256 is computed while copying, the stored file does not have to be read again for its storage path
+        audio_file_path, audio_digest = uploads.store_stream(uploaded_file.stream, original_filename, _upload_dir)
+
+        # Optional section of the take (e.g. start=1:20, end=1:45), only that range is decoded and transcribed
+        time_range = uploads.parse_time_range(
+            request.form.get('start') or request.args.get('start'),
+            request.form.get('end') or request.args.get('end')
+        )
+        conversion_path = audio_file_path
+        if time_range is not None:
+            conversion_path = uploads.extract_range(audio_file_path, *time_range)
 
         logger.info(f"Starting conversion using model: {model_type}")
         
+        # Model modules (TensorFlow) are imported only for the model that is actually used
         if model_type == 'crepe':
-             xml_file_path, midi_file_path = crepe_convert.convert(audio_file_path, preprocessing=preprocessing)
+             import crepe_convert
+             xml_file_path, midi_file_path = crepe_convert.convert(conversion_path, preprocessing=preprocessing)
         else:
              # Default to basic pitch
-             xml_file_path, midi_file_path = basic_pitch_convert.convert(audio_file_path)
+             import basic_pitch_convert
+             xml_file_path, midi_file_path = basic_pitch_convert.convert(conversion_path)
+        if conversion_path != audio_file_path:
+            os.remove(conversion_path)
 
         with open(xml_file_path, "r", encoding="utf-8") as f:
             xml_data = f.read()
             
         with open(midi_file_path, "rb") as f:
             midi_bytes = f.read()
-        midi_b64 = base64.b64encode(midi_bytes).decode("ascii")
             
-        bucket = storage.bucket()
-        unique_id = str(uuid.uuid4())
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         base_name = os.path.splitext(original_filename)[0]
+        xml_bytes = xml_data.encode("utf-8")
         
-        storage_path_xml = f"conversions/{timestamp}_{unique_id}/{base_name}.musicxml"
-        storage_path_midi = f"conversions/{timestamp}_{unique_id}/{base_name}.mid"
-        storage_path_audio = f"conversions/{timestamp}_{unique_id}/{original_filename}"
-        
-        blob_xml = bucket.blob(storage_path_xml)
-        blob_xml.upload_from_filename(xml_file_path)
-        
-        blob_midi = bucket.blob(storage_path_midi)
-        blob_midi.upload_from_filename(midi_file_path)
-
-        blob_audio = bucket.blob(storage_path_audio)
-        blob_audio.upload_from_filename(audio_file_path)
-        
-        credentials, project_id = google.auth.default()
-        service_account_email = 'default'
-        if hasattr(credentials, 'service_account_email'):
-            service_account_email = credentials.service_account_email
-            
-        if not service_account_email or service_account_email == 'default':
-            try:
-                auth_request = google_requests.Request()
-                credentials.refresh(auth_request)
-                service_account_email = credentials.service_account_email
-            except Exception:
-                pass
-
-        if not service_account_email or service_account_email == 'default':
-            try:
-                import requests
-                metadata_url = "http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/email"
-                metadata_headers = {"Metadata-Flavor": "Google"}
-                response = requests.get(metadata_url, headers=metadata_headers, timeout=2)
-                if response.status_code == 200:
-                    service_account_email = response.text.strip()
-            except Exception:
-                pass
+        # Blobs are keyed by content hash, repeated uploads of the same file share them
+        storage_path_xml = persistence.content_path("scores", data=xml_bytes, extension=".musicxml")
+        storage_path_midi = persistence.content_path("scores", data=midi_bytes, extension=".mid")
+        storage_path_audio = persistence.content_path(
+            "audio", digest=audio_digest, extension=os.path.splitext(audio_file_path)[1].lower()
+        )
         
-        signing_credentials = credentials
-        if not hasattr(credentials, 'sign_bytes'):
-            try:
-                if service_account_email == 'default':
-                     raise ValueError("Cannot setup IAM signer with 'default' service account email")
-                
-                signing_credentials = impersonated_credentials.Credentials(
-                    source_credentials=credentials,
-                    target_principal=service_account_email,
-                    target_scopes=['https://www.googleapis.com/auth/cloud-platform'],
-                    lifetime=3600
-                )
-            except Exception as e:
-                logger.error(f"Could not setup IAM signer: {e}")
-                pass
-
+        # v4 URLs can be signed before the objects exist.
+        # URLs saved in the song document are signed anew, a cached one may expire within a day
         try:
-            xml_url = blob_xml.generate_signed_url(
-                version='v4',
-                expiration=datetime.timedelta(days=7), 
-                method='GET',
-                service_account_email=service_account_email,
-                credentials=signing_credentials
-            )
-            midi_url = blob_midi.generate_signed_url(
-                version='v4',
-                expiration=datetime.timedelta(days=7), 
-                method='GET',
-                service_account_email=service_account_email,
-                credentials=signing_credentials
-            )
-            audio_url = blob_audio.generate_signed_url(
-                version='v4',
-                expiration=datetime.timedelta(days=7), 
-                method='GET',
-                service_account_email=service_account_email,
-                credentials=signing_credentials
+            xml_url, midi_url, audio_url = artifact_storage.signed_urls(
+                [storage_path_xml, storage_path_midi, storage_path_audio], persisted=bool(user_id)
             )
         except Exception as e:
             logger.error(f"Failed to generate signed URLs: {e}")
@@ -222,12 +169,12 @@ def process_audio_request(model_type='basic_pitch', preprocessing=False):
             midi_url = ""
             audio_url = ""
         
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        
         firestore_id = None
+        song_callbacks = {}
         if user_id:
             try:
                 db = firestore.client()
+                # The document id is generated locally, the write happens in the background
                 doc_ref = db.collection('users').document(user_id).collection('songs').document()
                 
                 song_data = {
@@ -247,28 +194,67 @@ def process_audio_request(model_type='basic_pitch', preprocessing=False):
                     'storagePathMidi': storage_path_midi,
                     'storagePathAudio': storage_path_audio,
                     'createdAt': firestore.SERVER_TIMESTAMP,
-                    'model': model_type
+                    'model': model_type,
+                    # The URLs work only once the uploads finish: "pending" -> "ready" or "failed"
+                    'status': 'pending'
                 }
                 
                 song_data = {k: v for k, v in song_data.items() if v is not None}
                 
-                doc_ref.set(song_data)
+                song_callbacks = {
+                    'on_start': lambda: doc_ref.set(song_data),
+                    'on_stored': lambda: doc_ref.update({'status': 'ready'}),
+                    'on_failed': lambda e: doc_ref.update({'status': 'failed'}),
+                }
                 firestore_id = doc_ref.id
             except Exception as e:
-                logger.error(f"Error saving to Firestore: {e}")
+                logger.error(f"Error preparing Firestore document: {e}")
         
-        response_data = {
-            "xml": xml_data,
-            "midi_base64": midi_b64,
+        # Uploads and the Firestore writes run after the response, off the critical path;
+        # the song document is created as "pending" and flipped to "ready" or "failed"
+        persistence_queue.submit(persistence.PersistJob(
+            artifacts=[
+                persistence.Artifact(storage_path_xml, data=xml_bytes, content_type="application/vnd.recordare.musicxml+xml", skip_if_exists=True),
+                persistence.Artifact(storage_path_midi, data=midi_bytes, content_type="audio/midi", skip_if_exists=True),
+                persistence.Artifact(storage_path_audio, local_path=audio_file_path, skip_if_exists=True),
+            ],
+            **song_callbacks,
+            cleanup=[audio_file_path],
+            name=f"conversion {base_name}"
+        ))
+        
+        response_fields = {
             "xml_url": xml_url,
             "midi_url": midi_url,
             "audio_url": audio_url,
             "filename": base_name,
-            "firestoreId": firestore_id
+            "firestoreId": firestore_id,
+            "storage_path_xml": storage_path_xml,
+            "storage_path_midi": storage_path_midi,
+            "storage_path_audio": storage_path_audio,
+            # The artifacts are uploaded after the response, the URLs may not resolve yet.
+            # The song document (firestoreId) holds the current status.
+            "storage_status": "pending"
         }
+        if time_range is not None:
+            response_fields["start"], response_fields["end"] = time_range
         
-        return (jsonify(response_data), 200, headers)
+        # JSON with base64 MIDI stays the default, binary modes are negotiated with the Accept header
+        mode = responses.negotiate(request.headers.get('Accept'))
+        body, content_type = responses.conversion_body(
+            mode, xml_data, midi_bytes,
+            accept_encoding=request.headers.get('Accept-Encoding'),
+            fields=response_fields
+        )
+        if mode == 'json':
+            return (jsonify(body), 200, headers)
+        headers['Vary'] = 'Accept, Accept-Encoding'
+        return Response(body, content_type=content_type, headers=headers)
         
+    except uploads.UploadRejected as e:
+        return (e.detail, e.status_code, headers)
+    except RequestEntityTooLarge:
+        return ('File too large', 413, headers)
     except Exception as e:
         logger.error(f"Error processing audio file: {str(e)}")
         import traceback
@@ -305,7 +291,7 @@ def midi_to_audio():
         headers = {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type, Range',
             'Access-Control-Max-Age': '3600'
         }
         return ('', 204, headers)
@@ -338,15 +324,11 @@ def midi_to_audio():
         else:
             return ('No midi file provided', 400, headers)
 
-        temp_dir = tempfile.mkdtemp()
-        midi_path = Path(temp_dir) / original_filename
-        midi_file.save(midi_path)
-        
-        file_size = os.path.getsize(midi_path)
-        logger.info(f"Saved MIDI file to {midi_path}, size: {file_size} bytes")
+        midi_bytes = midi_file.read()
+        logger.info(f"Received MIDI file {original_filename}, size: {len(midi_bytes)} bytes")
         
         try:
-            mid = mido.MidiFile(midi_path)
+            mid = mido.MidiFile(file=BytesIO(midi_bytes))
             logger.info(f"MIDI file loaded successfully. Type: {mid.type}, Length: {mid.length} seconds, Tracks: {len(mid.tracks)}")
             
             # Log first few messages to verify content
@@ -360,66 +342,36 @@ def midi_to_audio():
             logger.info("MIDI content sample:\n" + "\n".join(sample_messages))
         except Exception as e:
             logger.error(f"Failed to parse MIDI file with mido: {e}")
-
-        wav_path = midi_path.with_suffix(".wav")
-        
-        # Use the soundfont installed in the Docker image
-        soundfont_path = "/usr/share/sounds/sf2/FluidR3_GM.sf2"
-        if not os.path.exists(soundfont_path):
-             logger.warning(f"Soundfont not found at {soundfont_path}, searching /usr/share/sounds/sf2/")
-             found_sf2 = False
-             if os.path.exists("/usr/share/sounds/sf2/"):
-                 for f in os.listdir("/usr/share/sounds/sf2/"):
-                     if f.endswith(".sf2"):
-                         soundfont_path = os.path.join("/usr/share/sounds/sf2/", f)
-                         logger.info(f"Found alternative soundfont: {soundfont_path}")
-                         found_sf2 = True
-                         break
-             
-             if not found_sf2:
-                # Fallback to local directory
-                soundfont_path = "FluidR3_GM.sf2" 
-                logger.warning(f"No soundfont found in system paths, trying local fallback: {soundfont_path}")
-
-        logger.info(f"Using soundfont: {soundfont_path}")
-        
-        # Direct fluidsynth call for better debugging and control
-        # Note: -F automatically outputs WAV format (not raw)
-        cmd = [
-            "fluidsynth",
-            "-ni",           # No shell, no interactive
-            "-g", "1.0",     # Gain
-            "-R", "0",       # Reverb OFF
-            "-C", "0",       # Chorus OFF
-            "-r", "44100",   # Sample rate
-            "-F", str(wav_path), # Output file (WAV format by default)
-            soundfont_path,
-            str(midi_path)
-        ]
-        
-        logger.info(f"Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            logger.error(f"Fluidsynth failed with return code {result.returncode}")
-            logger.error(f"Stdout: {result.stdout}")
-            logger.error(f"Stderr: {result.stderr}")
-            return (f"Fluidsynth failed: {result.stderr}", 500, headers)
-            
-        logger.info(f"Fluidsynth stdout: {result.stdout}")
-        # logger.info(f"Fluidsynth stderr: {result.stderr}") # Stderr contains the rendering progress logs
-
-        if not os.path.exists(wav_path) or os.path.getsize(wav_path) < 100:
-             logger.error(f"WAV file generation failed or file too small. Size: {os.path.getsize(wav_path) if os.path.exists(wav_path) else 'Not Found'}")
-             return ("WAV generation failed", 500, headers)
-
-        with open(wav_path, "rb") as f:
-            wav_bytes = f.read()
-        
-        logger.info(f"Generated WAV size: {len(wav_bytes)} bytes")
-        shutil.rmtree(temp_dir, ignore_errors=True)
-
-        return Response(wav_bytes, mimetype="audio/wav", headers=headers)
+            return (f"Invalid MIDI file: {e}", 400, headers)
+
+        audio_format = (request.form.get('format') or request.args.get('format') or 'wav').lower()
+        if audio_format not in audio_output.FORMATS:
+            return (f"Unsupported format: {audio_format}", 400, headers)
+        mimetype = audio_output.media_type(audio_format)
+        pool = get_synth_pool()
+
+        if request.range is None:
+            # Stream the encoded audio while it is being synthesized
+            chunks = audio_output.encode_iter(pool.render_iter(mid), audio_format, pool.sample_rate)
+            headers['Accept-Ranges'] = 'bytes'
+            return Response(chunks, mimetype=mimetype, headers=headers)
+
+        # Range requests need the full length, keep the encoded file cached for the follow-up ranges
+        key = audio_output.EncodedAudioCache.key(midi_bytes, audio_format)
+        audio_bytes = _audio_cache.get(key)
+        if audio_bytes is None:
+            audio_bytes = audio_output.encode_bytes(pool.render_iter(mid), audio_format, pool.sample_rate)
+            if len(audio_bytes) < 100:
+                logger.error(f"Audio generation failed or file too small. Size: {len(audio_bytes)}")
+                return ("Audio generation failed", 500, headers)
+            _audio_cache.put(key, audio_bytes)
+
+        logger.info(f"Generated {audio_format} size: {len(audio_bytes)} bytes")
+        response = Response(audio_bytes, mimetype=mimetype, headers=headers)
+        try:
+            return response.make_conditional(request, accept_ranges=True, complete_length=len(audio_bytes))
+        except RequestedRangeNotSatisfiable:
+            return ('Requested range not satisfiable', 416, {**headers, 'Content-Range': f'bytes */{len(audio_bytes)}'})
     except Exception as e:
         logger.error(f"Error converting MIDI to audio: {e}")
         import traceback
@@ -3,14 +3,13 @@
 # ================================================
 
 import numpy as np
-import librosa
 import scipy.signal
 from mido import Message, MidiFile, MidiTrack, bpm2tempo
 from pathlib import Path
 import shutil
-import essentia.standard as es
-import matplotlib.pyplot as plt
-from music21 import converter
+
+# librosa, essentia i music21 są importowane dopiero w funkcjach, które ich używają
+# (skraca start procesu, który nie wykonuje transkrypcji)
 
 def generate_notes(y, sr, time, f0, confidence, time_step):
     """
@@ -183,6 +182,9 @@ def predict_tempo(filepath):
     :param filepath: Path to an audiofile
     :return: Estimated tempo in BPM
     """
+    import essentia.standard as es
+    import librosa
+
     try:
         audio = es.MonoLoader(filename=filepath)()
         bpm, _, _, _ = es.RhythmExtractor()(audio)
@@ -201,6 +203,8 @@ def predict_tempo(filepath):
     return bpm
 
 def generate_xml(midi_path, output_filename):
+    from music21 import converter
+
     score = converter.parse(midi_path)
     for p in score.parts:
         p.partName = ""
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Artifact:
+    """File to store: either `data` bytes or a `local_path`."""
+    path: str
+    data: bytes = None
+    local_path: str = None
+    content_type: str = None
+    # Content-addressed paths hold the same bytes whoever uploads them, so existing blobs are not sent again
+    skip_if_exists: bool = False
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_path(prefix, data=None, local_path=None, extension="", digest=None):
+    """
+    Builds a content-addressed storage path: <prefix>/<sha256 of the content><extension>.
+
+    :param digest: Hex SHA-256 already known (e.g. computed while the upload was streamed), nothing is hashed
+    """
+    if digest is None:
+        digest = hashlib.sha256(data).hexdigest() if data is not None else sha256_file(local_path)
+    return f"{prefix}/{digest}{extension}"
+
+
+@dataclass
+class PersistJob:
+    artifacts: list
+    # Called before the artifacts are stored (e.g. Firestore song document with a "pending" status)
+    on_start: object = None
+    # Called after all artifacts are stored (e.g. marking the song document as ready)
+    on_stored: object = None
+    # Called with the exception when the job failed (e.g. marking the song document as failed)
+    on_failed: object = None
+    # Local files removed once the job is finished, whether it succeeded or not
+    cleanup: list = field(default_factory=list)
+    name: str = ""
+
+
+def _retry(fn, attempts, backoff, description):
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"{description} failed (attempt {attempt}/{attempts}): {e}")
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+class PersistenceQueue:
+    """
+    Background queue storing conversion artifacts after the response was sent.
+    Artifacts of a job are uploaded concurrently, every step is retried with exponential backoff.
+
+    Note: on Cloud Run the queue keeps working after the response only with CPU always allocated.
+    """
+
+    def __init__(self, backend, workers=2, upload_concurrency=3, attempts=3, backoff=0.5):
+        self.backend = backend
+        self.attempts = attempts
+        self.backoff = backoff
+        self._jobs = queue.Queue()
+        self._uploads = ThreadPoolExecutor(max_workers=workers * upload_concurrency, thread_name_prefix="persist-upload")
+        self._threads = [
+            threading.Thread(target=self._run, name=f"persist-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, job):
+        self._jobs.put(job)
+
+    def join(self, timeout=None):
+        """Waits until all submitted jobs are processed. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._jobs.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _store(self, artifact):
+        if artifact.skip_if_exists and self.backend.exists(artifact.path):
+            logger.info(f"{artifact.path} already stored, skipping upload")
+            return
+        if artifact.data is not None:
+            self.backend.upload_bytes(artifact.path, artifact.data, artifact.content_type)
+        else:
+            self.backend.upload_file(artifact.path, artifact.local_path, artifact.content_type)
+
+    def _process(self, job):
+        if job.on_start is not None:
+            _retry(job.on_start, self.attempts, self.backoff, f"Starting {job.name}")
+        futures = [
+            self._uploads.submit(_retry, lambda a=a: self._store(a), self.attempts, self.backoff, f"Upload of {a.path}")
+            for a in job.artifacts
+        ]
+        for f in futures:
+            f.result()
+        if job.on_stored is not None:
+            _retry(job.on_stored, self.attempts, self.backoff, f"Saving {job.name}")
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                self._process(job)
+                logger.info(f"Persisted {job.name or 'job'}: {len(job.artifacts)} artifacts")
+            except Exception as e:
+                logger.error(f"Persisting {job.name or 'job'} failed: {e}")
+                if job.on_failed is not None:
+                    try:
+                        job.on_failed(e)
+                    except Exception as failed_error:
+                        logger.error(f"Reporting the failure of {job.name or 'job'} failed: {failed_error}")
+            finally:
+                for path in job.cleanup:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._jobs.task_done()
@@ -0,0 +1,172 @@
+import base64
+import gzip
+import json
+import uuid
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+MULTIPART_TYPE = "multipart/mixed"
+MUSICXML_TYPE = "application/vnd.recordare.musicxml+xml"
+MIDI_TYPE = "audio/midi"
+NOTES_BINARY_TYPE = "application/octet-stream"
+NOTE_COLUMNS = ("onset", "offset", "pitch", "velocity")
+
+
+def _media_ranges(header):
+    """Returns media ranges from an Accept-like header, ordered by q-value."""
+    ranges = []
+    for i, item in enumerate((header or "").split(",")):
+        parts = [p.strip() for p in item.split(";")]
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranges.append((-q, i, parts[0].lower()))
+    return [value for _, _, value in sorted(ranges)]
+
+
+def negotiate(accept):
+    """
+    Chooses the response mode of a conversion from the Accept header.
+
+    :param accept: Value of the Accept header
+    :return: "msgpack", "multipart" or "json" (default)
+    """
+    for media_range in _media_ranges(accept):
+        if media_range in MSGPACK_TYPES and msgpack is not None:
+            return "msgpack"
+        if media_range == MULTIPART_TYPE:
+            return "multipart"
+        if media_range in ("application/json", "*/*", "application/*"):
+            return "json"
+    return "json"
+
+
+def choose_encoding(accept_encoding):
+    """
+    Chooses the MusicXML compression from the Accept-Encoding header.
+
+    :return: "br", "gzip" or "identity"
+    """
+    for coding in _media_ranges(accept_encoding):
+        if coding == "br" and brotli is not None:
+            return "br"
+        if coding == "gzip":
+            return "gzip"
+    return "identity"
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+def _multipart(parts):
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for headers, payload in parts:
+        body += f"--{boundary}\r\n".encode("ascii")
+        for name, value in headers.items():
+            body += f"{name}: {value}\r\n".encode("ascii")
+        body += b"\r\n" + payload + b"\r\n"
+    body += f"--{boundary}--\r\n".encode("ascii")
+    return bytes(body), f'{MULTIPART_TYPE}; boundary="{boundary}"'
+
+
+def conversion_body(mode, xml_data, midi_bytes, accept_encoding=None, fields=None):
+    """
+    Builds the body of a conversion response.
+
+    :param mode: Response mode returned by negotiate()
+    :param xml_data: MusicXML document (str), None when the client skipped it
+    :param midi_bytes: MIDI file bytes
+    :param accept_encoding: Value of the Accept-Encoding header, used to compress the MusicXML in binary modes
+    :param fields: Additional metadata fields (urls, ids, ...)
+    :return: (body, content type); for "json" the body is a dict in the original {"xml", "midi_base64"} shape
+    """
+    fields = dict(fields or {})
+    if mode == "json":
+        return {"xml": xml_data, "midi_base64": base64.b64encode(midi_bytes).decode("ascii"), **fields}, "application/json"
+
+    encoding = choose_encoding(accept_encoding)
+    xml_bytes = compress(xml_data.encode("utf-8"), encoding) if xml_data is not None else None
+
+    if mode == "msgpack":
+        payload = {"xml": xml_bytes, "xml_encoding": encoding, "midi": midi_bytes, **fields}
+        return msgpack.packb(payload, use_bin_type=True), MSGPACK_TYPES[0]
+
+    parts = []
+    if fields:
+        parts.append(({"Content-Type": "application/json"}, json.dumps(fields).encode("utf-8")))
+    if xml_bytes is not None:
+        xml_headers = {"Content-Type": MUSICXML_TYPE, "Content-Disposition": 'attachment; filename="output.musicxml"'}
+        if encoding != "identity":
+            xml_headers["Content-Encoding"] = encoding
+        parts.append((xml_headers, xml_bytes))
+    parts.append(({"Content-Type": MIDI_TYPE, "Content-Disposition": 'attachment; filename="output.mid"'}, midi_bytes))
+    return _multipart(parts)
+
+
+def negotiate_notes(accept):
+    """
+    Chooses the format of a note-list response (output=notes) from the Accept header.
+
+    :return: "binary", "msgpack" or "json" (default)
+    """
+    for media_range in _media_ranges(accept):
+        if media_range == NOTES_BINARY_TYPE:
+            return "binary"
+        if media_range in MSGPACK_TYPES and msgpack is not None:
+            return "msgpack"
+        if media_range in ("application/json", "*/*", "application/*"):
+            return "json"
+    return "json"
+
+
+def notes_body(mode, notes, fields=None):
+    """
+    Builds the body of a note-list response in columnar form, one array per column of NOTE_COLUMNS.
+
+    The binary layout is little endian: uint32 count, float32 onsets[count], float32 offsets[count],
+    uint8 pitches[count], uint8 velocities[count] (10 bytes per note, fields are not included).
+
+    :param mode: Response mode returned by negotiate_notes()
+    :param notes: Notes [(onset s, offset s, MIDI pitch, velocity)]
+    :param fields: Additional metadata fields (json and msgpack only)
+    :return: (body, content type); for "json" the body is a dict
+    """
+    onsets = [round(float(n[0]), 4) for n in notes]
+    offsets = [round(float(n[1]), 4) for n in notes]
+    pitches = [min(127, max(0, int(round(n[2])))) for n in notes]
+    velocities = [min(127, max(0, int(round(n[3])))) for n in notes]
+
+    if mode == "binary":
+        import struct
+
+        count = len(notes)
+        body = struct.pack(f"<I{count}f{count}f{count}B{count}B", count, *onsets, *offsets, *pitches, *velocities)
+        return body, NOTES_BINARY_TYPE
+
+    columns = dict(zip(NOTE_COLUMNS, (onsets, offsets, pitches, velocities)))
+    payload = {"count": len(notes), **columns, **dict(fields or {})}
+    if mode == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True), MSGPACK_TYPES[0]
+    return payload, "application/json"
@@ -0,0 +1,144 @@
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+URL_EXPIRATION = datetime.timedelta(days=7)
+# Cached URLs are handed out only while they stay valid for at least this long
+REFRESH_MARGIN = datetime.timedelta(days=1)
+
+
+def resolve_signing_credentials():
+    """
+    Resolves the default credentials, the service account email and credentials able to sign URLs.
+    Can hit the metadata server and set up an IAM signer, so it should run once per instance.
+
+    :return: (service_account_email, signing_credentials)
+    """
+    import google.auth
+    from google.auth import impersonated_credentials
+    from google.auth.transport import requests as google_requests
+
+    credentials, project_id = google.auth.default()
+    service_account_email = 'default'
+    if hasattr(credentials, 'service_account_email'):
+        service_account_email = credentials.service_account_email
+
+    if not service_account_email or service_account_email == 'default':
+        try:
+            auth_request = google_requests.Request()
+            credentials.refresh(auth_request)
+            service_account_email = credentials.service_account_email
+        except Exception:
+            pass
+
+    if not service_account_email or service_account_email == 'default':
+        try:
+            import requests
+            metadata_url = "http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/email"
+            metadata_headers = {"Metadata-Flavor": "Google"}
+            response = requests.get(metadata_url, headers=metadata_headers, timeout=2)
+            if response.status_code == 200:
+                service_account_email = response.text.strip()
+        except Exception:
+            pass
+
+    signing_credentials = credentials
+    if not hasattr(credentials, 'sign_bytes'):
+        try:
+            if service_account_email == 'default':
+                raise ValueError("Cannot setup IAM signer with 'default' service account email")
+
+            # Impersonated credentials refresh themselves, so they can be reused between requests
+            signing_credentials = impersonated_credentials.Credentials(
+                source_credentials=credentials,
+                target_principal=service_account_email,
+                target_scopes=['https://www.googleapis.com/auth/cloud-platform'],
+                lifetime=3600
+            )
+        except Exception as e:
+            logger.error(f"Could not setup IAM signer: {e}")
+
+    return service_account_email, signing_credentials
+
+
+class UrlSigner:
+    """
+    Generates v4 signed GET URLs for storage blobs.
+    Credentials are resolved once and reused, URLs are signed concurrently and cached per storage path
+    until they get close to expiry. A cached URL may have little validity left, so URLs that are stored
+    (e.g. in a Firestore document) should be signed with fresh=True.
+
+    For tests pass a `credentials_resolver` returning fake credentials and blobs with a fake
+    `generate_signed_url`; `clock` can replace time.time.
+    """
+
+    def __init__(self, credentials_resolver=resolve_signing_credentials, expiration=URL_EXPIRATION,
+                 refresh_margin=REFRESH_MARGIN, max_workers=4, max_cached=1024, clock=time.time):
+        self._resolve = credentials_resolver
+        self.expiration = expiration
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self._signing = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.max_cached = max_cached
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="url-signer")
+
+    def _credentials(self):
+        with self._lock:
+            if self._signing is None:
+                self._signing = self._resolve()
+            return self._signing
+
+    def reset(self):
+        """Drops the resolved credentials and cached URLs, e.g. after a signing error."""
+        with self._lock:
+            self._signing = None
+            self._cache.clear()
+
+    def _cache_key(self, blob):
+        bucket = getattr(blob, 'bucket', None)
+        return getattr(bucket, 'name', None), blob.name
+
+    def sign(self, blob, fresh=False):
+        """
+        Returns a signed GET URL for the blob, reusing a cached one if it is still valid long enough.
+
+        :param fresh: Always sign a new URL valid for the full expiration, e.g. for URLs that are persisted
+        """
+        key = self._cache_key(blob)
+        now = self._clock()
+        with self._lock:
+            cached = self._cache.get(key)
+        if not fresh and cached is not None and cached[1] - now > self.refresh_margin.total_seconds():
+            return cached[0]
+
+        service_account_email, signing_credentials = self._credentials()
+        url = blob.generate_signed_url(
+            version='v4',
+            expiration=self.expiration,
+            method='GET',
+            service_account_email=service_account_email,
+            credentials=signing_credentials
+        )
+        with self._lock:
+            self._cache[key] = (url, now + self.expiration.total_seconds())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return url
+
+    def sign_many(self, blobs, fresh=False):
+        """
+        Signs several blobs concurrently.
+
+        :param fresh: See sign()
+        :return: List of URLs in the order of `blobs`
+        """
+        self._credentials()
+        return list(self._executor.map(lambda blob: self.sign(blob, fresh), blobs))
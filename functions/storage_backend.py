@@ -0,0 +1,122 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import signing
+
+
+class StorageBackend:
+    """
+    Interface of the storage used for conversion artifacts.
+    Paths are bucket-relative, e.g. "conversions/<id>/song.mid".
+    """
+
+    def upload_bytes(self, path, data, content_type=None):
+        raise NotImplementedError
+
+    def upload_file(self, path, local_path, content_type=None):
+        raise NotImplementedError
+
+    def exists(self, path):
+        raise NotImplementedError
+
+    def signed_urls(self, paths, persisted=False):
+        """
+        :param persisted: The URLs are stored (e.g. in Firestore), so they must stay valid for the full expiration
+        :return: List of URLs for reading the given paths, in the same order
+        """
+        raise NotImplementedError
+
+
+class FirebaseStorageBackend(StorageBackend):
+    """Firebase Storage (Google Cloud Storage) bucket, URLs signed by a shared UrlSigner."""
+
+    def __init__(self, bucket=None, url_signer=None):
+        self._bucket = bucket
+        self._bucket_lock = threading.Lock()
+        self.url_signer = url_signer or signing.UrlSigner()
+
+    @property
+    def bucket(self):
+        with self._bucket_lock:
+            if self._bucket is None:
+                from firebase_admin import storage
+                self._bucket = storage.bucket()
+            return self._bucket
+
+    def upload_bytes(self, path, data, content_type=None):
+        self.bucket.blob(path).upload_from_string(data, content_type=content_type)
+
+    def upload_file(self, path, local_path, content_type=None):
+        self.bucket.blob(path).upload_from_filename(local_path, content_type=content_type)
+
+    def exists(self, path):
+        return self.bucket.blob(path).exists()
+
+    def signed_urls(self, paths, persisted=False):
+        try:
+            return self.url_signer.sign_many([self.bucket.blob(path) for path in paths], fresh=persisted)
+        except Exception:
+            self.url_signer.reset()
+            raise
+
+
+class LocalStorageBackend(StorageBackend):
+    """Directory on the local filesystem, for development and tests."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _target(self, path):
+        target = self.root / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        return target
+
+    def upload_bytes(self, path, data, content_type=None):
+        self._target(path).write_bytes(data)
+
+    def upload_file(self, path, local_path, content_type=None):
+        shutil.copyfile(local_path, self._target(path))
+
+    def exists(self, path):
+        return (self.root / path).exists()
+
+    def signed_urls(self, paths, persisted=False):
+        return [(self.root / path).resolve().as_uri() for path in paths]
+
+
+class MemoryStorageBackend(StorageBackend):
+    """In-memory stand-in for tests."""
+
+    def __init__(self):
+        self.blobs = {}
+        self._lock = threading.Lock()
+
+    def upload_bytes(self, path, data, content_type=None):
+        with self._lock:
+            self.blobs[path] = bytes(data)
+
+    def upload_file(self, path, local_path, content_type=None):
+        with open(local_path, "rb") as f:
+            self.upload_bytes(path, f.read(), content_type)
+
+    def exists(self, path):
+        with self._lock:
+            return path in self.blobs
+
+    def signed_urls(self, paths, persisted=False):
+        return [f"memory://{path}" for path in paths]
+
+
+def create_backend(spec=None):
+    """
+    Creates the storage backend from a spec string (FASTSCORE_STORAGE env variable by default):
+    "firebase" (default), "local:<directory>" or "memory".
+    """
+    spec = spec or os.environ.get("FASTSCORE_STORAGE", "firebase")
+    if spec == "memory":
+        return MemoryStorageBackend()
+    if spec.startswith("local:"):
+        return LocalStorageBackend(spec[len("local:"):])
+    return FirebaseStorageBackend()
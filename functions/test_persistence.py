@@ -0,0 +1,90 @@
+import os
+
+import persistence
+import storage_backend
+
+
+class FlakyBackend(storage_backend.MemoryStorageBackend):
+    """Memory backend whose first `failures` uploads raise."""
+
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+        self.uploads = 0
+
+    def upload_bytes(self, path, data, content_type=None):
+        self.uploads += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("upload failed")
+        super().upload_bytes(path, data, content_type)
+
+
+def run_job(backend, job, attempts=2):
+    queue = persistence.PersistenceQueue(backend, workers=1, attempts=attempts, backoff=0)
+    queue.submit(job)
+    assert queue.join(timeout=10)
+
+
+def recording_job(events, artifacts, **fields):
+    return persistence.PersistJob(
+        artifacts=artifacts,
+        on_start=lambda: events.append("start"),
+        on_stored=lambda: events.append("stored"),
+        on_failed=lambda e: events.append(("failed", str(e))),
+        name="test",
+        **fields,
+    )
+
+
+def test_callbacks_run_around_a_stored_job(tmp_path):
+    backend = storage_backend.MemoryStorageBackend()
+    local = tmp_path / "audio.wav"
+    local.write_bytes(b"RIFF")
+    events = []
+    run_job(backend, recording_job(events, [
+        persistence.Artifact("scores/a.mid", data=b"midi"),
+        persistence.Artifact("audio/a.wav", local_path=str(local)),
+    ], cleanup=[str(local)]))
+
+    assert events == ["start", "stored"]
+    assert backend.blobs == {"scores/a.mid": b"midi", "audio/a.wav": b"RIFF"}
+    assert not os.path.exists(local)
+
+
+def test_failed_upload_reports_failure_after_retries():
+    backend = FlakyBackend(failures=5)
+    events = []
+    run_job(backend, recording_job(events, [persistence.Artifact("scores/a.mid", data=b"midi")]), attempts=2)
+
+    assert events == ["start", ("failed", "upload failed")]
+    assert backend.uploads == 2
+
+
+def test_upload_is_retried_until_it_succeeds():
+    backend = FlakyBackend(failures=1)
+    events = []
+    run_job(backend, recording_job(events, [persistence.Artifact("scores/a.mid", data=b"midi")]), attempts=2)
+
+    assert events == ["start", "stored"]
+    assert backend.blobs == {"scores/a.mid": b"midi"}
+
+
+def test_existing_content_addressed_blob_is_not_uploaded_again():
+    backend = FlakyBackend()
+    backend.blobs["scores/a.mid"] = b"midi"
+    events = []
+    run_job(backend, recording_job(events, [
+        persistence.Artifact("scores/a.mid", data=b"midi", skip_if_exists=True),
+    ]))
+
+    assert events == ["start", "stored"]
+    assert backend.uploads == 0
+
+
+def test_content_path_uses_a_known_digest_or_hashes_the_content(tmp_path):
+    local = tmp_path / "audio.wav"
+    local.write_bytes(b"audio")
+    from_data = persistence.content_path("audio", data=b"audio", extension=".wav")
+    assert persistence.content_path("audio", local_path=str(local), extension=".wav") == from_data
+    assert persistence.content_path("audio", digest="abc", extension=".wav") == "audio/abc.wav"
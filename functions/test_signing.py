@@ -0,0 +1,76 @@
+import datetime
+
+import signing
+
+
+class FakeBucket:
+    name = "bucket"
+
+
+class FakeBlob:
+    """Blob whose signed URLs count how many times they were signed."""
+
+    signed = 0
+
+    def __init__(self, name):
+        self.name = name
+        self.bucket = FakeBucket()
+
+    def generate_signed_url(self, version, expiration, method, service_account_email, credentials):
+        FakeBlob.signed += 1
+        return f"https://signed/{self.name}?n={FakeBlob.signed}&exp={int(expiration.total_seconds())}"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, delta):
+        self.now += delta.total_seconds()
+
+
+def make_signer(clock):
+    return signing.UrlSigner(credentials_resolver=lambda: ("signer@example.com", object()), clock=clock)
+
+
+def test_cached_url_is_reused_until_the_refresh_margin():
+    clock = FakeClock()
+    signer = make_signer(clock)
+    first = signer.sign(FakeBlob("scores/a.mid"))
+    clock.advance(signing.URL_EXPIRATION - signing.REFRESH_MARGIN - datetime.timedelta(minutes=1))
+    assert signer.sign(FakeBlob("scores/a.mid")) == first
+
+    clock.advance(datetime.timedelta(minutes=2))
+    refreshed = signer.sign(FakeBlob("scores/a.mid"))
+    assert refreshed != first
+    # The refreshed URL is valid for the full expiration again
+    clock.advance(signing.URL_EXPIRATION - signing.REFRESH_MARGIN - datetime.timedelta(minutes=1))
+    assert signer.sign(FakeBlob("scores/a.mid")) == refreshed
+
+
+def test_fresh_url_is_signed_even_when_cached():
+    clock = FakeClock()
+    signer = make_signer(clock)
+    cached = signer.sign(FakeBlob("scores/b.mid"))
+    clock.advance(datetime.timedelta(days=5))
+    fresh = signer.sign(FakeBlob("scores/b.mid"), fresh=True)
+    assert fresh != cached
+    # The new URL replaces the cached one
+    assert signer.sign(FakeBlob("scores/b.mid")) == fresh
+
+
+def test_sign_many_keeps_order_and_reset_drops_the_cache():
+    signer = make_signer(FakeClock())
+    blobs = [FakeBlob(f"scores/{i}.mid") for i in range(5)]
+    urls = signer.sign_many(blobs)
+    assert [url.split("?")[0] for url in urls] == [f"https://signed/scores/{i}.mid" for i in range(5)]
+    assert signer.sign_many(blobs) == urls
+    assert signer.sign_many(blobs, fresh=True) != urls
+
+    before = FakeBlob.signed
+    signer.reset()
+    signer.sign(blobs[0])
+    assert FakeBlob.signed == before + 1
@@ -0,0 +1,88 @@
+import storage_backend
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = (bytes(data), content_type)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, "rb") as f:
+            self.upload_from_string(f.read(), content_type)
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+
+class FakeBucket:
+    name = "bucket"
+
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+class FakeSigner:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+        self.resets = 0
+
+    def sign_many(self, blobs, fresh=False):
+        self.calls.append(([blob.name for blob in blobs], fresh))
+        if self.fail:
+            raise RuntimeError("signing failed")
+        return [f"https://signed/{blob.name}" for blob in blobs]
+
+    def reset(self):
+        self.resets += 1
+
+
+def test_firebase_backend_uploads_and_checks_existence(tmp_path):
+    bucket = FakeBucket()
+    backend = storage_backend.FirebaseStorageBackend(bucket=bucket, url_signer=FakeSigner())
+    local = tmp_path / "audio.wav"
+    local.write_bytes(b"RIFF")
+
+    assert not backend.exists("scores/a.mid")
+    backend.upload_bytes("scores/a.mid", b"midi", "audio/midi")
+    backend.upload_file("audio/a.wav", str(local))
+
+    assert backend.exists("scores/a.mid")
+    assert bucket.objects == {"scores/a.mid": (b"midi", "audio/midi"), "audio/a.wav": (b"RIFF", None)}
+
+
+def test_firebase_backend_signs_persisted_urls_fresh_and_resets_after_errors():
+    signer = FakeSigner()
+    backend = storage_backend.FirebaseStorageBackend(bucket=FakeBucket(), url_signer=signer)
+    assert backend.signed_urls(["a", "b"]) == ["https://signed/a", "https://signed/b"]
+    backend.signed_urls(["a"], persisted=True)
+    assert signer.calls == [(["a", "b"], False), (["a"], True)]
+
+    signer.fail = True
+    try:
+        backend.signed_urls(["a"])
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("signing error was swallowed")
+    assert signer.resets == 1
+
+
+def test_local_and_memory_backends(tmp_path):
+    local = storage_backend.LocalStorageBackend(tmp_path)
+    local.upload_bytes("scores/a.mid", b"midi")
+    assert local.exists("scores/a.mid")
+    assert (tmp_path / "scores" / "a.mid").read_bytes() == b"midi"
+    assert local.signed_urls(["scores/a.mid"])[0].startswith("file://")
+
+    memory = storage_backend.create_backend("memory")
+    assert not memory.exists("a")
+    memory.upload_bytes("a", bytearray(b"data"))
+    assert memory.exists("a") and memory.blobs["a"] == b"data"
+    assert memory.signed_urls(["a"]) == ["memory://a"]
@@ -0,0 +1,222 @@
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+# Stan trwających konwersji dla klientów: GET /jobs/{id} i strumień Server-Sent Events GET /jobs/{id}/events.
+# Identyfikator może nadać klient (nagłówek X-Job-Id albo parametr job_id, UUID) i otworzyć strumień zdarzeń
+# jeszcze przed wysłaniem pliku; bez niego serwer nadaje nowy i zwraca go w nagłówku X-Job-Id.
+# Zakończone zadania są pamiętane przez FASTSCORE_JOB_TTL_S sekund, spóźniony klient dostaje wszystkie zdarzenia.
+# Wszystkie metody wywoływane są z pętli zdarzeń (zdarzenia z workerów przekazuje ModelPool.submit).
+
+TTL_S = float(os.environ.get("FASTSCORE_JOB_TTL_S", "600"))
+MAX_JOBS = 1000
+TERMINAL = ("done", "error")
+# wyniki do pobrania z /jobs/{id}/{nazwa} w trybie progresywnym
+RESULTS = ("midi", "xml", "notes")
+
+
+class JobConflict(Exception):
+    """A conversion with this job ID is already running."""
+
+
+def parse_job_id(value):
+    """
+    :return: Job ID normalized to 32 hex digits, None if the value is not a UUID
+    """
+    if not value:
+        return None
+    try:
+        return uuid.UUID(value).hex
+    except ValueError:
+        return None
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class Job:
+    """
+    Events of one conversion. Stage events come from the request timer in the API process and from the
+    worker (timing.StageTimer listener), "done" / "error" end the stream.
+    """
+
+    def __init__(self, job_id, model=None):
+        self.id = job_id
+        self.model = model
+        self.status = "pending"
+        self.stage = None
+        self.events = []
+        self.created = time.time()
+        self.finished_at = None
+        # tryb progresywny: wyniki trzymane do pobrania, a nie tylko sygnalizowane zdarzeniem
+        self.keep_results = False
+        self.results = {}
+        self._start = time.perf_counter()
+        self._subscribers = set()
+
+    @property
+    def finished(self):
+        return self.status in TERMINAL
+
+    def elapsed(self):
+        return round(time.perf_counter() - self._start, 3)
+
+    def publish(self, kind, **data):
+        event = {"event": kind, "elapsed_s": self.elapsed(), **data}
+        self.events.append(event)
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def stage_event(self, event, stage, value=None):
+        """Listener of timing.StageTimer, also receives the events forwarded from the worker."""
+        if event == "start":
+            self.stage = stage
+            self.publish("stage", stage=stage, state="started")
+        elif event == "end":
+            self.publish("stage", stage=stage, state="finished", seconds=round(value, 4))
+        elif event == "progress":
+            self.publish("progress", stage=stage, percent=round(100 * value, 1))
+        elif event == "result":
+            self.add_result(stage, value)
+
+    def add_result(self, name, value):
+        """
+        Publishes a result as soon as it exists: "midi" ({"midi": bytes, "bpm", optional "notes"}) and "notes"
+        (list, output=notes) are small enough to be sent in the event itself, "xml" (str) is only announced
+        and downloaded from the job URL.
+        """
+        data = {"name": name}
+        if name == "midi":
+            data["midi_base64"] = base64.b64encode(value["midi"]).decode("ascii")
+            data.update((k, value[k]) for k in ("bpm", "notes") if value.get(k) is not None)
+        elif name == "notes":
+            data["notes"] = value
+        if self.keep_results:
+            self.results[name] = value
+            data["url"] = f"/jobs/{self.id}/{name}"
+        self.publish("result", **data)
+
+    def start(self, model):
+        self.model = model
+        self.status = "running"
+        self._start = time.perf_counter()
+        self.publish("accepted", job_id=self.id, model=model)
+
+    def finish(self, outcome, **data):
+        """
+        :param outcome: "done" or "error"
+        :param data: Fields of the final event, e.g. the HTTP status of the response
+        """
+        if self.finished:
+            return
+        self.status = outcome
+        self.stage = None
+        self.finished_at = time.time()
+        self.publish(outcome, **data)
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "model": self.model,
+            "status": self.status,
+            "stage": self.stage,
+            "elapsed_s": (round(self.finished_at - self.created, 3) if self.finished_at else self.elapsed()),
+            "results": {name: f"/jobs/{self.id}/{name}" for name in self.results},
+            "events": self.events,
+        }
+
+    async def follow(self, keepalive_s=15.0):
+        """
+        Yields the events published so far and then the new ones until the job finishes.
+        None is yielded after keepalive_s without an event (e.g. to send an SSE comment).
+        """
+        queue = asyncio.Queue()
+        # kopia historii i zapis subskrypcji bez await pomiędzy - żadne zdarzenie nie zginie ani nie powtórzy się
+        history = list(self.events)
+        self._subscribers.add(queue)
+        try:
+            for event in history:
+                yield event
+            if self.finished:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive_s)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event["event"] in TERMINAL:
+                    return
+        finally:
+            self._subscribers.discard(queue)
+
+
+class JobRegistry:
+    def __init__(self, ttl_s=TTL_S, max_jobs=MAX_JOBS):
+        self.ttl_s = ttl_s
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            # zadania, do których klient się tylko podłączył, a pliku nie wysłał, też wygasają
+            if (job.finished_at or job.created) + self.ttl_s < now and job.status != "running":
+                del self._jobs[job_id]
+        while len(self._jobs) > self.max_jobs:
+            oldest = next((i for i, j in self._jobs.items() if j.status != "running"), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest]
+
+    def get(self, job_id):
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def watch(self, job_id):
+        """Job to follow, created as "pending" when the client subscribes before sending the file."""
+        job = self.get(job_id)
+        if job is None:
+            job = self._jobs[job_id] = Job(job_id)
+        return job
+
+    def start(self, job_id, model):
+        """
+        Marks the job as running (a finished job with the same ID is replaced).
+
+        :raises JobConflict: The job is already running
+        """
+        job = self.get(job_id)
+        if job is not None and job.status == "running":
+            raise JobConflict(job_id)
+        if job is None or job.finished:
+            job = self._jobs[job_id] = Job(job_id)
+        job.start(model)
+        return job
+
+
+def sse_stream(job, last_event_id=None, keepalive_s=15.0):
+    """
+    Events of a job formatted as a text/event-stream body.
+
+    :param last_event_id: Value of the Last-Event-ID header of a reconnecting client, earlier events are skipped
+    """
+    # id zdarzenia = jego numer, przeglądarka (EventSource) wznawia połączenie od ostatniego odebranego
+    skip = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def stream():
+        index = 0
+        async for event in job.follow(keepalive_s):
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            index += 1
+            if index > skip:
+                yield f"id: {index}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    return stream()
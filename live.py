@@ -0,0 +1,239 @@
+import subprocess
+import threading
+
+import numpy as np
+
+# Transkrypcja na żywo (WebSocket /ws/convert-crepe): audio przychodzi fragmentami w trakcie nagrywania,
+# CREPE liczy wysokość dźwięku dla kolejnych okien (z zakładką), a segmentacja generate_notes działa na
+# nierozstrzygniętym końcu nagrania. Nuty, które kończą się wystarczająco daleko przed końcem nagrania,
+# są uznawane za ostateczne i wysyłane do klienta.
+
+SAMPLE_RATE = 16000
+FRAME_S = 0.01
+_FRAME = int(SAMPLE_RATE * FRAME_S)
+ENCODINGS = ("pcm_f32le", "pcm_s16le", "webm", "ogg")
+
+
+def _int_option(config, name, default, low, high):
+    try:
+        value = int(config.get(name, default))
+    except (TypeError, ValueError):
+        value = None
+    if value is None or not low <= value <= high:
+        raise ValueError(f"{name} must be an integer between {low} and {high}")
+    return value
+
+
+def parse_config(config):
+    """
+    Validates the session config sent by the client before any audio.
+
+    :return: (encoding, sample_rate, channels)
+    :raises ValueError: Malformed or unsupported value, the message is meant as the WebSocket close reason
+    """
+    if not isinstance(config, dict):
+        raise ValueError("Config must be a JSON object")
+    encoding = config.get("encoding", "pcm_f32le")
+    if encoding not in ENCODINGS:
+        raise ValueError(f"encoding must be one of {', '.join(ENCODINGS)}")
+    return (
+        encoding,
+        _int_option(config, "sample_rate", SAMPLE_RATE, 8000, 192000),
+        _int_option(config, "channels", 1, 1, 8),
+    )
+
+
+class AudioDecoder:
+    """
+    Decodes audio chunks sent by the client to mono float32 samples at 16 kHz.
+
+    "pcm_f32le" mono at 16 kHz is used as is. Other raw PCM ("pcm_s16le", "pcm_f32le" at another rate or
+    channel count) and containers recorded by MediaRecorder ("webm", "ogg") are decoded by ffmpeg.
+    """
+
+    def __init__(self, encoding="pcm_f32le", sample_rate=SAMPLE_RATE, channels=1):
+        self._decoded = []
+        self._remainder = b""
+        self._lock = threading.Lock()
+        self._proc = None
+        if encoding == "pcm_f32le" and sample_rate == SAMPLE_RATE and channels == 1:
+            return
+
+        if encoding in ("pcm_s16le", "pcm_f32le"):
+            input_args = ["-f", encoding[len("pcm_"):], "-ar", str(sample_rate), "-ac", str(channels)]
+        else:
+            # kontener rozpoznawany przez ffmpeg
+            input_args = []
+        cmd = [
+            "ffmpeg", "-v", "error", *input_args, "-i", "pipe:0",
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "pipe:1",
+        ]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while data := self._proc.stdout.read1(64 * 1024):
+            with self._lock:
+                self._decoded.append(data)
+
+    def write(self, data):
+        if self._proc is None:
+            with self._lock:
+                self._decoded.append(data)
+            return
+        try:
+            self._proc.stdin.write(data)
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+
+    def take(self):
+        """
+        :return: Samples decoded since the previous call
+        """
+        with self._lock:
+            data = self._remainder + b"".join(self._decoded)
+            self._decoded = []
+            usable = len(data) - len(data) % 4
+            self._remainder = data[usable:]
+        return np.frombuffer(data[:usable], dtype="<f4").astype(np.float32)
+
+    def finish(self, timeout=10):
+        """Flushes the decoder after the last chunk."""
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._reader.join(timeout=timeout)
+        self._proc.wait(timeout=timeout)
+
+    def close(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+
+class LiveTranscription:
+    """
+    State of one streaming session: the received audio, its pitch track computed so far and the notes
+    that were already finalized.
+
+    :param hop_s: Minimum amount of new audio that triggers the next pitch window
+    :param context_s: Audio before the new part included in a window, so that CREPE (and its Viterbi
+                      smoothing) sees the notes that continue into the new part
+    :param settle_s: Notes ending closer than this to the end of the pitch track may still change
+    """
+
+    def __init__(self, hop_s=1.0, context_s=1.0, settle_s=0.5, max_unsettled_s=15.0):
+        self.hop_s = hop_s
+        self.context_s = context_s
+        self.settle_s = settle_s
+        self.max_unsettled_s = max_unsettled_s
+        # bufor z zapasem rośnie geometrycznie - dopisanie fragmentu nie kopiuje całego nagrania
+        self._buffer = np.zeros(10 * SAMPLE_RATE, dtype=np.float32)
+        self._length = 0
+        self.f0 = np.zeros(0, dtype=np.float32)
+        self.confidence = np.zeros(0, dtype=np.float32)
+        self.notes = []
+        self._settled_frame = 0
+
+    @property
+    def audio(self):
+        """Samples received so far (a view of the buffer)."""
+        return self._buffer[:self._length]
+
+    @property
+    def tracked(self):
+        """Samples covered by the pitch track."""
+        return len(self.f0) * _FRAME
+
+    @property
+    def duration(self):
+        return self._length / SAMPLE_RATE
+
+    def add_audio(self, samples):
+        end = self._length + len(samples)
+        if end > len(self._buffer):
+            grown = np.zeros(max(end, 2 * len(self._buffer)), dtype=np.float32)
+            grown[:self._length] = self.audio
+            self._buffer = grown
+        self._buffer[self._length:end] = samples
+        self._length = end
+
+    def pending_s(self):
+        return (len(self.audio) - self.tracked) / SAMPLE_RATE
+
+    def next_window(self, final=False):
+        """
+        Audio for the next pitch job: the untracked samples (whole frames only) plus some context before them.
+
+        :return: (window samples, number of context frames to skip in the result, number of new frames),
+                 None when there isn't enough new audio
+        """
+        new_frames = (len(self.audio) - self.tracked) // _FRAME
+        if new_frames <= 0 or (not final and new_frames * FRAME_S < self.hop_s):
+            return None
+        start = max(0, self.tracked - int(self.context_s * SAMPLE_RATE) // _FRAME * _FRAME)
+        end = self.tracked + new_frames * _FRAME
+        return self.audio[start:end], (self.tracked - start) // _FRAME, new_frames
+
+    def add_pitch(self, f0, confidence, skip, count):
+        """Appends the frames of a pitch job that belong to the new audio."""
+        f0 = np.asarray(f0, dtype=np.float32)[skip:skip + count]
+        confidence = np.asarray(confidence, dtype=np.float32)[skip:skip + count]
+        if len(f0) < count:
+            # CREPE może zwrócić o ramkę mniej na końcu okna - powtarzamy ostatnią wartość
+            missing = count - len(f0)
+            f0 = np.concatenate([f0, np.repeat(f0[-1:] if len(f0) else [0.0], missing)])
+            confidence = np.concatenate([confidence, np.zeros(missing, dtype=np.float32)])
+        self.f0 = np.concatenate([self.f0, f0])
+        self.confidence = np.concatenate([self.confidence, confidence])
+
+    def settle(self, final=False):
+        """
+        Segments the unsettled part of the pitch track like notes_tools.generate_notes.
+
+        :param final: Recording has stopped, every remaining note is final
+        :return: Newly finalized notes [(onset s, offset s, MIDI pitch, velocity)], absolute times
+        """
+        import notes_tools
+
+        start, end = self._settled_frame, len(self.f0)
+        if end - start < 10:
+            return []
+        y = self.audio[start * _FRAME:end * _FRAME]
+        time = np.arange(end - start) * FRAME_S
+        try:
+            notes = notes_tools.generate_notes(y, SAMPLE_RATE, time, self.f0[start:end],
+                                               self.confidence[start:end], FRAME_S)
+        except (ValueError, IndexError, ZeroDivisionError):
+            # np. sama cisza - brak granic nut do wyznaczenia
+            notes = []
+
+        horizon = (end - start) * FRAME_S - (0 if final else self.settle_s)
+        settled = [n for n in notes if n[1] <= horizon] if not final else notes
+        if settled:
+            self._settled_frame = start + int(round(settled[-1][1] / FRAME_S))
+        elif not final and (end - start) * FRAME_S > self.max_unsettled_s:
+            # długo bez żadnej nuty (cisza) - nie analizujemy tego fragmentu ponownie
+            self._settled_frame = end - int(self.settle_s / FRAME_S)
+
+        offset = start * FRAME_S
+        settled = [(float(on) + offset, float(off) + offset, float(pitch), float(velocity))
+                   for on, off, pitch, velocity in settled]
+        self.notes.extend(settled)
+        return settled
+
+    def write_wav(self, path):
+        """Writes the received audio as 16-bit WAV (used for tempo detection of the whole take)."""
+        import wave
+
+        pcm = (np.clip(self.audio, -1.0, 1.0) * 32767).astype("<i2")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm.tobytes())
@@ -0,0 +1,78 @@
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Metryki w formacie Prometheus udostępniane przez /metrics:
+#  - fastscore_request_duration_seconds - czas obsługi żądania per endpoint i status
+#  - fastscore_stage_duration_seconds - czasy etapów (timing.py) per endpoint
+#  - fastscore_coalesced_requests_total - żądania obsłużone przez identyczną konwersję już w toku
+#  - fastscore_pool_* - stan kolejek i workerów, odczytywany z ModelPool przy każdym odczycie metryk
+
+_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+REQUEST_SECONDS = Histogram(
+    "fastscore_request_duration_seconds", "Request latency", ["endpoint", "status"], buckets=_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "fastscore_stage_duration_seconds", "Duration of a processing stage", ["endpoint", "stage"], buckets=_BUCKETS,
+)
+COALESCED = Counter(
+    "fastscore_coalesced_requests", "Requests that shared an identical conversion already in flight", ["model"],
+)
+
+
+def observe_request(endpoint, status, seconds):
+    REQUEST_SECONDS.labels(endpoint, str(status)).observe(seconds)
+
+
+def observe_stages(endpoint, timer):
+    """Records every stage of a timing.StageTimer."""
+    for name, seconds in timer.stages.items():
+        STAGE_SECONDS.labels(endpoint, name).observe(seconds)
+
+
+def observe_coalesced(model):
+    COALESCED.labels(model).inc()
+
+
+class PoolCollector:
+    """
+    Exposes queue depth, worker state and utilization of model pools. Utilization of a pool is
+    rate(fastscore_pool_busy_seconds_total) / fastscore_pool_workers.
+    """
+
+    def __init__(self, pools):
+        self.pools = pools
+
+    def collect(self):
+        gauges = {
+            "queued": GaugeMetricFamily("fastscore_pool_queued_jobs", "Jobs waiting for a worker", labels=["model"]),
+            "running": GaugeMetricFamily("fastscore_pool_running_jobs", "Jobs being processed", labels=["model"]),
+            "workers": GaugeMetricFamily("fastscore_pool_workers", "Worker processes", labels=["model"]),
+            "ready": GaugeMetricFamily("fastscore_pool_ready_workers", "Warmed up workers", labels=["model"]),
+            "busy": GaugeMetricFamily("fastscore_pool_busy_workers", "Workers processing a job", labels=["model"]),
+        }
+        counters = {
+            "busy_seconds": CounterMetricFamily("fastscore_pool_busy_seconds", "Time workers spent on jobs",
+                                                labels=["model"]),
+            "restarts": CounterMetricFamily("fastscore_pool_restarts", "Worker restarts", labels=["model"]),
+            "crashes": CounterMetricFamily("fastscore_pool_crashes", "Worker crashes", labels=["model"]),
+            "timeouts": CounterMetricFamily("fastscore_pool_timeouts", "Jobs over the deadline", labels=["model"]),
+            "recycled": CounterMetricFamily("fastscore_pool_recycled", "Recycled workers", labels=["model"]),
+        }
+        for pool in self.pools:
+            status = pool.status()
+            for key, family in {**gauges, **counters}.items():
+                family.add_metric([pool.name], status[key])
+        yield from gauges.values()
+        yield from counters.values()
+
+
+def register_pools(pools):
+    REGISTRY.register(PoolCollector(pools))
+
+
+def render():
+    """
+    :return: (body, content type) of the /metrics response
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
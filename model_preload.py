@@ -0,0 +1,26 @@
+"""
+Preloaded in the fork server (FASTSCORE_WORKER_START=forkserver), so that imported libraries and,
+optionally, model weights are shared copy-on-write between the forked worker processes.
+
+Weights are loaded only with FASTSCORE_PRELOAD_WEIGHTS=1. This is experimental: TensorFlow is not
+guaranteed to be fork-safe once its runtime is initialised, so every worker still runs its warm-up
+inference after the fork, and a worker that fails it is reported as not warm.
+"""
+import os
+
+import numpy  # noqa: F401
+import scipy.signal  # noqa: F401
+import librosa  # noqa: F401
+import essentia.standard  # noqa: F401
+import music21  # noqa: F401
+import tensorflow  # noqa: F401
+import crepe  # noqa: F401
+import basic_pitch.inference  # noqa: F401
+
+import crepe_convert  # noqa: F401
+import basic_pitch_convert
+import workers  # noqa: F401
+
+if os.environ.get("FASTSCORE_PRELOAD_WEIGHTS") == "1":
+    crepe.core.build_and_load_model("full")
+    basic_pitch_convert._get_model()
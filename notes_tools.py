@@ -3,15 +3,17 @@
 # ================================================
 
 import numpy as np
-import librosa
 import scipy.signal
 from mido import Message, MidiFile, MidiTrack, bpm2tempo
 from pathlib import Path
 import shutil
-import essentia.standard as es
-import matplotlib.pyplot as plt
-from music21 import converter
 
+import timing
+
+# librosa, essentia i music21 są importowane dopiero w funkcjach, które ich używają
+# (skraca start procesu, który nie wykonuje transkrypcji)
+
+@timing.timed("notes")
 def generate_notes(y, sr, time, f0, confidence, time_step):
     """
     Method for generating note events from values extracted from an audio file.
@@ -155,6 +157,7 @@ def generate_notes(y, sr, time, f0, confidence, time_step):
     # plt.show()
     return notes
 
+@timing.timed("midi")
 def save_notes_to_midi(notes, output_dir, output_file_name="output.mid", bpm=120):
     """
     Saves a list of notes to a MIDI file.
@@ -205,6 +208,24 @@ def save_notes_to_midi(notes, output_dir, output_file_name="output.mid", bpm=120
     print(f"✅ Zapisano {len(notes)} nut do pliku: {output_path}")
     return output_path
 
+def publish_midi(midi_path, notes=None, bpm=None):
+    """
+    Hands the finished MIDI (and the notes it was written from) to the listener of the active timer,
+    so that the client can get it before generate_xml finishes. No-op when nobody listens.
+
+    :param midi_path: Path to the MIDI file
+    :param notes: Optional list of notes: [(onset_s, offset_s, midi_pitch, amplitude)]
+    :param bpm: Tempo written to the MIDI file
+    """
+    if not timing.reporting():
+        return
+    with open(midi_path, "rb") as f:
+        result = {"midi": f.read(), "bpm": bpm}
+    if notes is not None:
+        result["notes"] = [[float(v) for v in note] for note in notes]
+    timing.partial("midi", result)
+
+@timing.timed("tempo")
 def predict_tempo(filepath):
     """
     Estimates the tempo (beats per minute) of an audio signal.
@@ -212,6 +233,9 @@ def predict_tempo(filepath):
     :param filepath: Path to an audiofile
     :return: Estimated tempo in BPM
     """
+    import essentia.standard as es
+    import librosa
+
     try:
         audio = es.MonoLoader(filename=filepath)()
         bpm, _, _, _ = es.RhythmExtractor()(audio)
@@ -229,7 +253,18 @@ def predict_tempo(filepath):
     bpm = int(round(bpm, 0))
     return bpm
 
+def warm_up():
+    """
+    Imports the libraries used by predict_tempo and generate_xml ahead of the first request.
+    """
+    import essentia.standard  # noqa: F401
+    import librosa  # noqa: F401
+    from music21 import converter  # noqa: F401
+
+@timing.timed("xml")
 def generate_xml(midi_path, output_filename):
+    from music21 import converter
+
     score = converter.parse(midi_path)
     for p in score.parts:
         p.partName = ""
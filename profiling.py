@@ -0,0 +1,121 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import uuid
+
+# Profilowanie pojedynczego żądania na życzenie: nagłówek "X-Profile: <token>" albo parametr "?profile=<token>",
+# gdzie token to FASTSCORE_PROFILE_TOKEN. Bez ustawionego tokenu profilowanie jest wyłączone.
+# Wyniki trafiają do PROFILE_DIR/<job_id>/: api.prof (proces API), worker.prof (worker modelu),
+# przy podziale długiego nagrania także worker-split.prof, worker-chunk<n>.prof i worker-tempo.prof
+# (zadania częściowe) oraz podsumowania *.txt. Pliki .prof można obejrzeć np. w snakeviz albo przerobić na flamegraph (flameprof).
+
+PROFILE_DIR = os.environ.get("FASTSCORE_PROFILE_DIR", "profiles")
+ARTIFACTS = ("api.prof", "api.txt", "worker.prof", "worker.txt")
+_PART_ARTIFACT = re.compile(r"worker-[a-z]+\d*\.(prof|txt)")
+
+
+def _token():
+    return os.environ.get("FASTSCORE_PROFILE_TOKEN")
+
+
+def authorized(value):
+    """Checks a token supplied by the client against FASTSCORE_PROFILE_TOKEN."""
+    token = _token()
+    return bool(token and value) and hmac.compare_digest(value.encode(), token.encode())
+
+
+def requested(headers, query_params):
+    """
+    :return: True if the request asks for profiling with a valid token
+    """
+    value = headers.get("x-profile") or query_params.get("profile")
+    return value is not None and authorized(value)
+
+
+def job_dir(job_id):
+    return os.path.join(PROFILE_DIR, job_id)
+
+
+def part_profile_path(worker_profile_path, part):
+    """
+    :param part: Name of a part job of a split conversion, e.g. "chunk2"
+    :return: Path of the part's worker profile next to worker.prof, e.g. worker-chunk2.prof
+    """
+    root, ext = os.path.splitext(worker_profile_path)
+    return f"{root}-{part}{ext}"
+
+
+def _known(job_id, name):
+    if name not in ARTIFACTS and not _PART_ARTIFACT.fullmatch(name):
+        return False
+    try:
+        uuid.UUID(hex=job_id)
+    except ValueError:
+        return False
+    return True
+
+
+def artifact_path(job_id, name):
+    """
+    :return: Path of a profile artifact, None for unknown names or job IDs
+    """
+    if not _known(job_id, name):
+        return None
+    path = os.path.join(job_dir(job_id), name)
+    return path if os.path.exists(path) else None
+
+
+def artifacts(job_id):
+    """
+    :return: Names of the stored profile artifacts of a job
+    """
+    try:
+        names = os.listdir(job_dir(job_id)) if _known(job_id, ARTIFACTS[0]) else []
+    except FileNotFoundError:
+        names = []
+    return sorted(name for name in names if _known(job_id, name))
+
+
+def write_summary(prof_path, limit=40):
+    """Writes the functions with the highest cumulative time next to a .prof file."""
+    out = io.StringIO()
+    pstats.Stats(prof_path, stream=out).sort_stats("cumulative").print_stats(limit)
+    with open(os.path.splitext(prof_path)[0] + ".txt", "w", encoding="utf-8") as f:
+        f.write(out.getvalue())
+
+
+class RequestProfile:
+    """
+    cProfile of one request in the API process. Only code running on the event loop thread is
+    measured, work done inside the worker is profiled separately (see worker_profile_path).
+    """
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        os.makedirs(job_dir(self.job_id), exist_ok=True)
+        self._profiler = cProfile.Profile()
+
+    @property
+    def worker_profile_path(self):
+        """Passed to the worker in the job dict ("profile"), the worker dumps its profile there."""
+        return os.path.join(job_dir(self.job_id), "worker.prof")
+
+    def __enter__(self):
+        try:
+            self._profiler.enable()
+        except ValueError:
+            # inne żądanie jest już profilowane w tym wątku (Python 3.12+ pozwala na jeden profiler)
+            self._profiler = None
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler is None:
+            return False
+        self._profiler.disable()
+        path = os.path.join(job_dir(self.job_id), "api.prof")
+        self._profiler.dump_stats(path)
+        write_summary(path)
+        return False
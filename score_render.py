@@ -0,0 +1,73 @@
+import re
+from io import BytesIO
+
+import verovio
+from reportlab.graphics import renderPDF
+from reportlab.pdfgen import canvas
+from svglib.svglib import svg2rlg
+
+
+def render_pdf(xml: str) -> bytes:
+    """
+    Renders a MusicXML score to an A4 PDF with Verovio.
+
+    :param xml: MusicXML document
+    :return: PDF file contents
+    """
+    tk = verovio.toolkit()
+    options = {
+        "scale": 80,
+        "footer": "none",
+        "header": "none",
+        "pageHeight": 2970,
+        "pageWidth": 2100,
+        "unit": 10,
+    }
+    tk.setOptions(options)
+
+    tk.loadData(xml)
+    page_count = tk.getPageCount()
+
+    packet = BytesIO()
+
+    pdf_w, pdf_h = 595.0, 842.0
+    c = canvas.Canvas(packet, pagesize=(pdf_w, pdf_h))
+
+    for page in range(1, page_count + 1):
+        svg = tk.renderToSVG(page)
+        svg = svg.replace("#00000", "#000000")
+        svg = fix_tempo(svg)
+
+        drawing = svg2rlg(BytesIO(svg.encode("utf-8")))
+
+        scale_x = pdf_w / 21000
+        scale_y = pdf_h / 29700
+        scale = min(scale_x, scale_y)
+
+        drawing.scale(scale, scale)
+        offset_y = -drawing.height * scale + pdf_h
+
+        renderPDF.draw(drawing, c, 0, offset_y)
+        c.showPage()
+
+    c.save()
+    return packet.getvalue()
+
+def fix_tempo(svg: str) -> str:
+    svg = re.sub(
+        r'<tspan[^>]*font-family=["\']Leipzig["\'][^>]*font-size=["\']800px["\'][^>]*>.*?</tspan>',
+        '',
+        svg,
+        flags=re.DOTALL
+    )
+
+    svg = re.sub(
+        r'<tspan[^>]*font-size=["\']450px["\'][^>]*>\s*=\s*</tspan>',
+        '',
+        svg,
+        flags=re.DOTALL
+    )
+
+    svg = re.sub(r'<tspan\b[^>]*>\s*</tspan>', '', svg)
+
+    return svg
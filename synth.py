@@ -0,0 +1,181 @@
+import os
+import queue
+import threading
+import wave
+from io import BytesIO
+
+import mido
+
+SAMPLE_RATE = 44100
+_BLOCK_FRAMES = 4096
+_TAIL_SECONDS = 1.0  # wybrzmienie po ostatnim komunikacie MIDI
+_SOUNDFONT_DIRS = ["/usr/share/sounds/sf2/"]
+
+
+def find_soundfont(preferred="FluidR3_GM.sf2"):
+    """
+    Finds a soundfont file, looking at the preferred path first and then in the system soundfont directories.
+
+    :param preferred: Preferred soundfont path or file name
+    :return: Path to the soundfont (the preferred path if nothing else was found)
+    """
+    if os.path.exists(preferred):
+        return preferred
+    for directory in _SOUNDFONT_DIRS:
+        candidate = os.path.join(directory, os.path.basename(preferred))
+        if os.path.exists(candidate):
+            return candidate
+    for directory in _SOUNDFONT_DIRS:
+        if os.path.isdir(directory):
+            for f in sorted(os.listdir(directory)):
+                if f.endswith(".sf2"):
+                    return os.path.join(directory, f)
+    return preferred
+
+
+def _load_midi(midi):
+    if isinstance(midi, mido.MidiFile):
+        return midi
+    if isinstance(midi, (bytes, bytearray)):
+        return mido.MidiFile(file=BytesIO(midi))
+    return mido.MidiFile(str(midi))
+
+
+class SynthEngine:
+    """
+    Long-lived in-process FluidSynth instance. The soundfont is loaded once and reused for every render.
+    An engine is not thread-safe, use SynthPool to share engines between threads.
+    """
+
+    def __init__(self, soundfont_path, sample_rate=SAMPLE_RATE, gain=0.2, reverb=True, chorus=True):
+        import fluidsynth
+
+        self.sample_rate = sample_rate
+        self._synth = fluidsynth.Synth(
+            gain=gain,
+            samplerate=sample_rate,
+            **{"synth.reverb.active": int(reverb), "synth.chorus.active": int(chorus)},
+        )
+        self._sfid = self._synth.sfload(str(soundfont_path), update_midi_preset=1)
+        if self._sfid == -1:
+            raise RuntimeError(f"Could not load soundfont: {soundfont_path}")
+
+    def _samples(self, frames):
+        while frames > 0:
+            n = min(frames, _BLOCK_FRAMES)
+            yield self._synth.get_samples(n)
+            frames -= n
+
+    def _dispatch(self, msg):
+        if msg.type == "note_on":
+            self._synth.noteon(msg.channel, msg.note, msg.velocity)
+        elif msg.type == "note_off":
+            self._synth.noteoff(msg.channel, msg.note)
+        elif msg.type == "control_change":
+            self._synth.cc(msg.channel, msg.control, msg.value)
+        elif msg.type == "program_change":
+            self._synth.program_change(msg.channel, msg.program)
+        elif msg.type == "pitchwheel":
+            self._synth.pitch_bend(msg.channel, msg.pitch)
+
+    def render_iter(self, midi):
+        """
+        Renders a MIDI file to PCM block by block.
+
+        :param midi: Path to a MIDI file, its bytes or a mido.MidiFile
+        :return: Generator of interleaved 16-bit stereo sample blocks (numpy int16 arrays)
+        """
+        mid = _load_midi(midi)
+        self._synth.system_reset()
+
+        now = 0.0
+        rendered = 0
+        # iteracja po MidiFile zwraca komunikaty z czasem w sekundach (uwzględnia zmiany tempa)
+        for msg in mid:
+            now += msg.time
+            target = int(now * self.sample_rate)
+            yield from self._samples(target - rendered)
+            rendered = max(rendered, target)
+            if not msg.is_meta:
+                self._dispatch(msg)
+        yield from self._samples(int(_TAIL_SECONDS * self.sample_rate))
+
+    def close(self):
+        self._synth.delete()
+
+
+class SynthPool:
+    """
+    Pool of SynthEngines shared between threads. Engines are created lazily, up to `size` (number of cores by default).
+    """
+
+    def __init__(self, soundfont_path, size=None, **engine_options):
+        self.soundfont_path = soundfont_path
+        self.size = size or os.cpu_count() or 1
+        self._engine_options = engine_options
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @property
+    def sample_rate(self):
+        return self._engine_options.get("sample_rate", SAMPLE_RATE)
+
+    def preload(self):
+        """Creates one engine up front so that the first request does not pay for loading the soundfont."""
+        self._release(self._acquire())
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return SynthEngine(self.soundfont_path, **self._engine_options)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _release(self, engine):
+        self._idle.put(engine)
+
+    def render_iter(self, midi):
+        """
+        Renders a MIDI file on a free engine, see SynthEngine.render_iter.
+        The engine stays checked out until the generator is exhausted or closed.
+        """
+        engine = self._acquire()
+        try:
+            yield from engine.render_iter(midi)
+        finally:
+            self._release(engine)
+
+    def render_wav(self, midi):
+        """
+        Renders a MIDI file to a WAV file kept in memory.
+
+        :param midi: Path to a MIDI file, its bytes or a mido.MidiFile
+        :return: WAV file bytes (16-bit stereo)
+        """
+        packet = BytesIO()
+        with wave.open(packet, "wb") as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            for block in self.render_iter(midi):
+                wav.writeframes(block.tobytes())
+        return packet.getvalue()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,113 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Etapy przetwarzania jednego żądania, np. upload, queue, preprocessing, inference, tempo, midi, xml, render.
+# Funkcje oznaczone @timed / stage() zapisują czas do aktywnego StageTimer bieżącego wątku;
+# bez aktywnego timera pomiar jest pomijany.
+# Timer może mieć listener, który dostaje zdarzenia na żywo: początek i koniec etapu, postęp
+# długich etapów (progress()) i wyniki częściowe (partial(), np. MIDI przed MusicXML),
+# np. do przesłania ich z workera do strumienia SSE.
+
+_local = threading.local()
+
+
+class StageTimer:
+    """
+    Durations of the named stages of one request, in seconds and in the order they started.
+
+    :param listener: Optional callable(event, stage, value) called with ("start", name, None) and
+                     ("end", name, seconds) around every stage(), with ("progress", name, fraction)
+                     and with ("result", name, value) for partial results
+    """
+
+    def __init__(self, listener=None):
+        self.stages = {}
+        self.listener = listener
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def update(self, stages):
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+
+    def notify(self, event, name, value=None):
+        if self.listener is not None:
+            self.listener(event, name, value)
+
+    @contextmanager
+    def stage(self, name):
+        self.notify("start", name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.add(name, seconds)
+            self.notify("end", name, seconds)
+
+    def server_timing(self):
+        """Value of the Server-Timing response header."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+@contextmanager
+def collect(timer=None, listener=None):
+    """
+    Makes a timer active in the current thread, so that stage() and @timed record into it.
+
+    :param timer: Timer to record into, a new one by default
+    :param listener: Listener of the new timer, see StageTimer
+    :return: Context manager yielding the active StageTimer
+    """
+    timer = timer or StageTimer(listener)
+    previous = getattr(_local, "timer", None)
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+def reporting():
+    """True if the active timer has a listener, i.e. progress of long stages is worth computing."""
+    timer = getattr(_local, "timer", None)
+    return timer is not None and timer.listener is not None
+
+
+def progress(name, fraction):
+    """Reports how much of a running stage is done (0.0 - 1.0), no-op without a listener."""
+    timer = getattr(_local, "timer", None)
+    if timer is not None:
+        timer.notify("progress", name, fraction)
+
+
+def partial(name, value):
+    """Hands a partial result (e.g. the MIDI before the MusicXML is ready) to the listener, no-op without one."""
+    timer = getattr(_local, "timer", None)
+    if timer is not None:
+        timer.notify("result", name, value)
+
+
+@contextmanager
+def stage(name):
+    """Measures a block as a stage of the active timer (no-op without one)."""
+    timer = getattr(_local, "timer", None)
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def timed(name):
+    """Decorator measuring every call of a function as the given stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
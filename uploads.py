@@ -0,0 +1,372 @@
+import hashlib
+import math
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+from pathlib import Path
+
+MAX_UPLOAD_BYTES = int(os.environ.get("FASTSCORE_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+MAX_DURATION_S = float(os.environ.get("FASTSCORE_MAX_DURATION_S", "1200"))
+SPOOL_THRESHOLD = 8 * 1024 * 1024
+_PROBE_BYTES = 64 * 1024
+_MAX_FIELD_BYTES = 64 * 1024
+_FORM_OVERHEAD = 64 * 1024
+
+# formaty dekodowane przez ffmpeg już w trakcie odbierania pliku
+STREAM_DECODED = {".opus"}
+
+
+def _multipart():
+    # python-multipart jest potrzebny tylko przy odbieraniu strumienia w FastAPI
+    try:
+        from python_multipart import multipart
+    except ImportError:  # starsze wersje python-multipart
+        from multipart import multipart
+    return multipart
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def wav_duration(header):
+    """
+    Reads the duration of a PCM WAV file from the beginning of the file.
+
+    :param header: First bytes of the file (fmt and data chunk headers must be included)
+    :return: Duration in seconds or None when it can't be determined
+    """
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    byte_rate = None
+    pos = 12
+    while pos + 8 <= len(header):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", header, pos)
+        if chunk_id == b"fmt " and pos + 20 <= len(header):
+            byte_rate = struct.unpack_from("<I", header, pos + 16)[0]
+        elif chunk_id == b"data":
+            if not byte_rate or chunk_size >= 0xFFFFFFFF - 36:
+                return None
+            return chunk_size / byte_rate
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def file_duration(path):
+    """
+    Duration of a stored upload read from its header, without decoding it.
+
+    :return: Duration in seconds, None for formats other than PCM WAV
+    """
+    with open(path, "rb") as f:
+        return wav_duration(f.read(_PROBE_BYTES))
+
+
+def parse_time(value):
+    """
+    Parses a position in a recording: seconds ("85", "85.5") or "m:ss" / "h:mm:ss" ("1:25", "0:01:25.5").
+
+    :return: Seconds
+    :raises ValueError: Malformed, negative or non-finite value ("nan", "inf", "1e999")
+    """
+    seconds = 0.0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0 or not math.isfinite(seconds):
+        raise ValueError(value)
+    return seconds
+
+
+def parse_time_range(start=None, end=None):
+    """
+    Parses the optional start / end parameters of a conversion request.
+
+    :return: (start, end) in seconds with end None for "until the end", or None when no range was given
+    :raises UploadRejected: Invalid range (400)
+    """
+    if not start and not end:
+        return None
+    try:
+        start_s = parse_time(start) if start else 0.0
+        end_s = parse_time(end) if end else None
+    except ValueError:
+        raise UploadRejected(400, "Invalid start / end, expected seconds or m:ss")
+    if end_s is not None and end_s <= start_s:
+        raise UploadRejected(400, "End must be after start")
+    return start_s, end_s
+
+
+def extract_range(path, start, end=None):
+    """
+    Cuts a time range out of a stored upload into a new WAV file. ffmpeg seeks in the input
+    (-ss before -i) instead of decoding the recording from the beginning.
+
+    :param path: Path to the stored upload
+    :param start: Start of the range in seconds
+    :param end: End of the range in seconds, None = until the end of the recording
+    :return: Path to the WAV file with the range
+    :raises UploadRejected: The range is outside the recording or ffmpeg could not extract it (400)
+    """
+    output_path = str(Path(path).with_suffix("")) + f"_{start:g}-{end if end is not None else 'end'}.wav"
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", str(start), "-i", str(path)]
+    if end is not None:
+        cmd += ["-t", str(end - start)]
+    cmd += ["-c:a", "pcm_s16le", output_path]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        print("FFmpeg error:", result.stderr.decode(errors="replace"))
+        Path(output_path).unlink(missing_ok=True)
+        raise UploadRejected(400, "Could not extract the selected range from the recording")
+    if not file_duration(output_path):
+        os.remove(output_path)
+        raise UploadRejected(400, "Selected range is outside the recording")
+    return output_path
+
+
+class _StreamingDecoder:
+    """ffmpeg process decoding the upload to a mono 44.1 kHz WAV file while the bytes are still arriving."""
+
+    def __init__(self, output_path, max_duration):
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-v", "error",
+            "-i", "pipe:0",
+            "-t", str(max_duration + 1),
+            "-ac", "1",
+            "-ar", "44100",
+            str(output_path),
+        ]
+        self.output_path = output_path
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def write(self, data):
+        try:
+            self._proc.stdin.write(data)
+        except BrokenPipeError:
+            pass
+
+    def finish(self, timeout=10):
+        self._proc.stdin.close()
+        try:
+            _, stderr = self._proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            print("FFmpeg timeout — proces zawiesił się.")
+            raise
+        if self._proc.returncode != 0:
+            print("FFmpeg error:", stderr.decode(errors="replace"))
+            raise subprocess.CalledProcessError(self._proc.returncode, "ffmpeg", stderr=stderr)
+
+    def kill(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+
+class SpooledUpload:
+    """
+    Buffer for an uploaded audio file. Kept in memory below SPOOL_THRESHOLD, rolled over to disk above it.
+    Size and duration limits are checked while the data is written, so oversized files are rejected early.
+    """
+
+    def __init__(self, filename, directory, max_bytes=MAX_UPLOAD_BYTES, max_duration=MAX_DURATION_S):
+        self.filename = os.path.basename(filename or "audio")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.size = 0
+        self.path = None
+        # skrót przesłanych bajtów - identyczne nagrania przetwarzane jednocześnie dzielą jedną konwersję
+        self._digest = hashlib.sha256()
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD)
+        self._head = bytearray()
+        self._decoder = None
+        if Path(self.filename).suffix.lower() in STREAM_DECODED:
+            self._decoder = _StreamingDecoder(self._new_path(".wav"), max_duration)
+
+    def _new_path(self, suffix):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{Path(self.filename).stem}_", suffix=suffix, dir=self.directory)
+        os.close(fd)
+        return path
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"File too large, limit is {self.max_bytes // (1024 * 1024)} MB")
+        self._digest.update(data)
+        if self._decoder is not None:
+            self._decoder.write(data)
+        else:
+            self._buffer.write(data)
+        if len(self._head) < _PROBE_BYTES:
+            self._head += data[:_PROBE_BYTES - len(self._head)]
+            self._check_duration(wav_duration(self._head))
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 of the bytes written so far (the file as uploaded, before any decoding)."""
+        return self._digest.hexdigest()
+
+    def _check_duration(self, duration):
+        if duration is not None and duration > self.max_duration:
+            raise UploadRejected(413, f"Recording too long, limit is {self.max_duration:.0f} s")
+
+    def finish(self):
+        """
+        Completes the upload and stores it where the conversion workers can read it.
+
+        :return: Path to the audio file (decoded WAV for formats in STREAM_DECODED)
+        """
+        if self.size == 0:
+            raise UploadRejected(400, "Empty file")
+        if self._decoder is not None:
+            self._decoder.finish()
+            self.path = self._decoder.output_path
+            with open(self.path, "rb") as f:
+                self._check_duration(wav_duration(f.read(_PROBE_BYTES)))
+        else:
+            self.path = self._new_path(Path(self.filename).suffix)
+            self._buffer.seek(0)
+            with open(self.path, "wb") as f:
+                shutil.copyfileobj(self._buffer, f)
+        self._buffer.close()
+        return self.path
+
+    def close(self):
+        if self._decoder is not None:
+            self._decoder.kill()
+            if self.path is None:
+                Path(self._decoder.output_path).unlink(missing_ok=True)
+        self._buffer.close()
+
+
+class _FormReceiver:
+    def __init__(self, file_field, directory, **limits):
+        self.file_field = file_field
+        self.directory = directory
+        self.limits = limits
+        self.upload = None
+        self.fields = {}
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._target = None
+        self._field_name = None
+        self._field_value = bytearray()
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._target = None
+        self._field_name = None
+        self._field_value = bytearray()
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = _multipart().parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        if name == self.file_field and filename is not None:
+            if self.upload is not None:
+                raise UploadRejected(400, "Only one file can be uploaded")
+            self.upload = SpooledUpload(filename.decode("utf-8", errors="replace"), self.directory, **self.limits)
+            self._target = self.upload
+        elif filename is None:
+            self._field_name = name
+
+    def on_part_data(self, data, start, end):
+        if self._target is not None:
+            self._target.write(data[start:end])
+        elif self._field_name is not None:
+            self._field_value += data[start:end]
+            if len(self._field_value) > _MAX_FIELD_BYTES:
+                raise UploadRejected(413, f"Form field too large: {self._field_name}")
+
+    def on_part_end(self):
+        if self._field_name is not None:
+            self.fields[self._field_name] = self._field_value.decode("utf-8", errors="replace")
+        self._target = None
+        self._field_name = None
+
+
+def store_stream(stream, filename, directory, chunk_size=64 * 1024, **limits):
+    """
+    Copies an already received file stream (e.g. werkzeug FileStorage.stream) into a SpooledUpload.
+
+    :return: (path to the stored audio file, see SpooledUpload.finish; SHA-256 of the file as uploaded)
+    """
+    upload = SpooledUpload(filename, directory, **limits)
+    try:
+        while chunk := stream.read(chunk_size):
+            upload.write(chunk)
+        return upload.finish(), upload.sha256
+    except BaseException:
+        upload.close()
+        raise
+
+
+async def receive_upload(request, directory, file_field="file", **limits):
+    """
+    Streams a multipart/form-data request body into a SpooledUpload as it arrives.
+
+    :param request: Starlette request whose body hasn't been read yet
+    :param directory: Directory for the stored upload
+    :param file_field: Name of the form field with the audio file
+    :param limits: Optional max_bytes / max_duration overrides
+    :return: (path to the stored audio file, original file name, other form fields, SHA-256 of the file)
+    """
+    from starlette.concurrency import run_in_threadpool
+
+    max_bytes = limits.get("max_bytes", MAX_UPLOAD_BYTES)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + _FORM_OVERHEAD:
+        raise UploadRejected(413, f"File too large, limit is {max_bytes // (1024 * 1024)} MB")
+
+    multipart = _multipart()
+    content_type, params = multipart.parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected multipart/form-data")
+
+    receiver = _FormReceiver(file_field, directory, **limits)
+    parser = multipart.MultipartParser(params[b"boundary"], receiver.callbacks())
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                # zapis może trafić na dysk lub do ffmpeg - poza pętlą zdarzeń
+                await run_in_threadpool(parser.write, chunk)
+        parser.finalize()
+        if receiver.upload is None:
+            raise UploadRejected(400, f"No file provided in field '{file_field}'")
+        path = await run_in_threadpool(receiver.upload.finish)
+    except BaseException:
+        if receiver.upload is not None:
+            receiver.upload.close()
+        raise
+    return path, receiver.upload.filename, receiver.fields, receiver.upload.sha256
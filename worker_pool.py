@@ -0,0 +1,516 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+_DISCONNECT_POLL_S = 0.5
+_LIVENESS_POLL_S = 1.0
+
+
+def configure_forkserver(modules):
+    """
+    Sets modules imported once in the fork server. Workers started with the "forkserver" method are forked
+    from that process and share the preloaded libraries (and weights, see model_preload.py) copy-on-write.
+    Must be called before the first forkserver worker starts.
+    """
+    multiprocessing.get_context("forkserver").set_forkserver_preload(list(modules))
+
+
+def assign_cpus(pools, available=None):
+    """
+    Splits CPUs between the workers of several pools, so that pinned workers don't share cores.
+    When there are fewer CPUs than requested threads, the assignment wraps around.
+
+    :param pools: List of (worker count, threads per worker) tuples
+    :param available: CPU ids to use, defaults to the CPUs this process may run on
+    :return: For every pool a list of CPU id lists, one per worker
+    """
+    cpus = sorted(available if available is not None else os.sched_getaffinity(0))
+    plan = []
+    position = 0
+    for count, threads in pools:
+        per_worker = []
+        for _ in range(count):
+            per_worker.append(sorted({cpus[(position + i) % len(cpus)] for i in range(threads)}))
+            position += threads
+        plan.append(per_worker)
+    return plan
+
+
+class WorkerError(Exception):
+    """The worker could not process the job."""
+
+
+class WorkerCrashed(WorkerError):
+    """The worker process died or closed its pipe while processing the job."""
+
+
+class WorkerTimeout(WorkerError):
+    """The job did not finish before its deadline."""
+
+
+class PoolBusy(Exception):
+    """The pool's queue is full, the client should retry after `retry_after` seconds."""
+
+    def __init__(self, pool_name, retry_after):
+        super().__init__(f"{pool_name} is busy, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """The client disconnected before the job reached a worker."""
+
+
+class ModelWorker:
+    """
+    One model worker process with its own pipe, see workers.py for the protocol.
+    """
+
+    def __init__(self, name, target, index, context=multiprocessing, options=None):
+        self.name = f"{name}-{index}"
+        self.index = index
+        self.conn, self._child_conn = context.Pipe()
+        self.process = context.Process(
+            target=target, args=(self._child_conn,), kwargs=options or {}, name=self.name, daemon=True
+        )
+        self.ready = False
+        self.busy = False
+        self.recycling = False
+        self.jobs = 0
+        self.info = {}
+        self.started_at = None
+
+    def start(self):
+        self.process.start()
+        self.started_at = time.monotonic()
+        # koniec potoku należy już do procesu workera - po jego śmierci recv() zgłosi EOFError zamiast blokować
+        self._child_conn.close()
+
+    def wait_ready(self):
+        """Blocks until the worker has loaded and warmed up its model. Returns the worker's ready info."""
+        kind, info = self.conn.recv()
+        if kind != "ready":
+            raise WorkerError(f"{self.name}: unexpected message {kind!r} before ready")
+        self.info = info
+        self.ready = True
+        return info
+
+    def call(self, job, timeout=None, timer=None, on_progress=None):
+        """
+        Sends a job to the worker and waits for its result.
+
+        :param job: Job dict
+        :param timeout: Seconds to wait for the result, None = no deadline
+        :param timer: Optional timing.StageTimer receiving the stage durations measured in the worker
+        :param on_progress: Optional callable receiving the stage events of the worker (sets "progress" in the job),
+                            called from the calling thread
+        :return: Result returned by the worker
+        :raises WorkerCrashed: The process died or its pipe was closed
+        :raises WorkerTimeout: No result before the deadline, the worker is left in an unknown state
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def check_deadline():
+            if deadline is not None and time.monotonic() > deadline:
+                raise WorkerTimeout(f"{self.name} did not finish the job within {timeout} s")
+
+        if on_progress is not None:
+            job = {**job, "progress": True}
+        try:
+            self.conn.send(job)
+            while True:
+                while not self.conn.poll(_LIVENESS_POLL_S):
+                    if not self.process.is_alive():
+                        raise WorkerCrashed(f"{self.name} exited with code {self.process.exitcode}")
+                    check_deadline()
+                kind, payload, *rest = self.conn.recv()
+                if kind != "progress":
+                    break
+                if on_progress is not None:
+                    on_progress(payload)
+                # worker zasypujący potok zdarzeniami postępu też podlega terminowi zadania
+                check_deadline()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(f"{self.name} pipe closed ({e!r}), exit code {self.process.exitcode}")
+        if kind == "error":
+            raise WorkerError(payload)
+        if timer is not None and rest:
+            timer.update(rest[0])
+        return payload
+
+    def stop(self, timeout=3):
+        if self.started_at is None:
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=timeout)
+        self.conn.close()
+
+    def rss_mb(self):
+        """Resident memory of the worker process in MB, None if it is gone."""
+        try:
+            return psutil.Process(self.process.pid).memory_info().rss / 2**20
+        except (psutil.Error, TypeError):
+            return None
+
+    def kill(self):
+        """Kills a crashed or hung worker without waiting for it to finish its job."""
+        self.process.kill()
+        self.process.join(timeout=3)
+        self.conn.close()
+
+
+class ModelPool:
+    """
+    Pool of worker processes running one model. Workers are handed out only after they reported ready.
+
+    :param start_method: multiprocessing start method ("fork", "spawn", "forkserver"), None = platform default
+    :param max_concurrency: Jobs dispatched to workers at once (defaults to `size`)
+    :param max_queue: Jobs allowed to wait for a free slot, further jobs are rejected with PoolBusy
+    :param job_timeout: Deadline of a single job in seconds, a worker that misses it is killed and restarted
+    :param start_timeout: Seconds a worker may take to load and warm up its model before it is restarted
+    :param supervise_interval: Seconds between liveness checks of idle and starting workers
+    :param max_jobs: Recycle a worker after this many jobs, None = never
+    :param max_rss_mb: Recycle a worker once its resident memory exceeds this many MB, None = never
+    :param threads: Thread budget of every worker (BLAS/OpenMP and TensorFlow), None = library defaults
+    :param cpus: CPU ids per worker index (see assign_cpus), None = no pinning
+    """
+
+    def __init__(self, name, target, size=1, start_method=None, max_concurrency=None, max_queue=8,
+                 job_timeout=None, start_timeout=600, supervise_interval=5, max_jobs=None, max_rss_mb=None,
+                 threads=None, cpus=None):
+        self.name = name
+        self.target = target
+        self.size = size
+        self.context = multiprocessing.get_context(start_method)
+        self.workers = []
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self.max_concurrency = max_concurrency or size
+        self.max_queue = max_queue
+        self.queued = 0
+        self.running = 0
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._avg_job_s = None
+        self.job_timeout = job_timeout
+        self.start_timeout = start_timeout
+        self.supervise_interval = supervise_interval
+        self.restarts = 0
+        self.crashes = 0
+        self.timeouts = 0
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.recycled = 0
+        self.busy_seconds = 0.0
+        self.threads = threads
+        self.cpus = cpus
+        self._pending = {}
+        self._stopping = False
+
+    def _new_worker(self, index):
+        # zastępcze workery (restart, recykling) dostają ten sam budżet i te same rdzenie
+        options = {}
+        if self.threads:
+            options["threads"] = self.threads
+        if self.cpus:
+            options["cpus"] = self.cpus[index]
+        return ModelWorker(self.name, self.target, index, self.context, options)
+
+    def start(self):
+        for i in range(self.size):
+            worker = self._new_worker(i)
+            self.workers.append(worker)
+            self._launch(worker)
+        threading.Thread(target=self._supervise, name=f"{self.name}-supervisor", daemon=True).start()
+
+    def _launch(self, worker):
+        worker.start()
+        threading.Thread(target=self._await_ready, args=(worker,), daemon=True).start()
+
+    def _await_ready(self, worker):
+        try:
+            info = worker.wait_ready()
+        except (EOFError, OSError, WorkerError) as e:
+            # martwy worker zostanie zrestartowany przez supervisora
+            print(f"{worker.name} failed to start: {e}")
+            self._abandon_replacement(worker)
+            return
+        print(f"{worker.name} ready: {info}")
+        if self._pending.get(worker.index) is worker:
+            self._swap_in(worker)
+        else:
+            self._release(worker)
+
+    def _is_current(self, worker):
+        return not self._stopping and self.workers[worker.index] is worker
+
+    def _restart(self, worker, reason, only_idle=False):
+        """
+        Replaces a dead or hung worker with a fresh process. Jobs on other workers are not affected.
+        A worker that was already replaced (e.g. recycled while running its last job) is only killed.
+
+        :param only_idle: Skip the restart if the worker was handed out or replaced in the meantime
+        """
+        with self._cond:
+            current = self._is_current(worker)
+            if only_idle and (not current or worker.busy):
+                return
+            if current:
+                if worker in self._idle:
+                    self._idle.remove(worker)
+                replacement = self._new_worker(worker.index)
+                self.workers[worker.index] = replacement
+                self.restarts += 1
+        if not current:
+            # slot ma już nowego workera, ale zawieszony proces i tak trzeba zabić
+            print(f"{worker.name} killed ({reason}), already replaced")
+            worker.kill()
+            return
+        print(f"{worker.name} restarting ({reason})")
+        worker.kill()
+        self._launch(replacement)
+
+    def _needs_recycling(self, worker):
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            return f"{worker.jobs} jobs"
+        if self.max_rss_mb:
+            rss = worker.rss_mb()
+            if rss is not None and rss > self.max_rss_mb:
+                return f"RSS {rss:.0f} MB"
+        return None
+
+    def _recycle(self, worker, reason):
+        """
+        Starts a replacement for a worker. The old worker keeps serving jobs until the replacement is warm,
+        then it is retired after its current job. Only one worker per pool is recycled at a time, so the pool
+        never runs more than `size` + 1 processes.
+        """
+        with self._cond:
+            if worker.recycling or self._pending or not self._is_current(worker):
+                return
+            worker.recycling = True
+            replacement = self._new_worker(worker.index)
+            self._pending[worker.index] = replacement
+        print(f"{worker.name} recycling ({reason}), starting a replacement")
+        self._launch(replacement)
+
+    def _swap_in(self, replacement):
+        with self._cond:
+            del self._pending[replacement.index]
+            if self._stopping:
+                old = replacement
+            else:
+                old = self.workers[replacement.index]
+                self.workers[replacement.index] = replacement
+                self._idle.append(replacement)
+                self._cond.notify()
+                self.recycled += 1
+            if old in self._idle:
+                self._idle.remove(old)
+            # zajęty worker zostanie zatrzymany przez _release() po zakończeniu zadania
+            retire_now = not old.busy
+        if retire_now:
+            self._retire(old)
+
+    def _abandon_replacement(self, worker):
+        with self._cond:
+            if self._pending.get(worker.index) is not worker:
+                return
+            del self._pending[worker.index]
+            # stary worker działa dalej, kolejna próba po następnym zadaniu
+            self.workers[worker.index].recycling = False
+        worker.kill()
+
+    def _retire(self, worker):
+        print(f"{worker.name} retired after {worker.jobs} jobs")
+        threading.Thread(target=worker.stop, daemon=True).start()
+
+    def _supervise(self):
+        while not self._stopping:
+            time.sleep(self.supervise_interval)
+            now = time.monotonic()
+            for worker in list(self.workers):
+                if worker.busy or worker.started_at is None:
+                    # zajęte workery sprawdza run() - ma termin zadania i widzi zamknięty potok
+                    continue
+                if not worker.process.is_alive():
+                    self.crashes += 1
+                    self._restart(worker, f"exited with code {worker.process.exitcode}", only_idle=True)
+                elif not worker.ready and now - worker.started_at > self.start_timeout:
+                    self._restart(worker, f"not ready after {self.start_timeout} s", only_idle=True)
+            for replacement in list(self._pending.values()):
+                if not replacement.process.is_alive() or now - replacement.started_at > self.start_timeout:
+                    print(f"{replacement.name} replacement did not become ready")
+                    self._abandon_replacement(replacement)
+
+    def wait_ready(self, timeout=None):
+        """Blocks until all workers reported ready. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not all(w.ready for w in self.workers):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def _acquire(self, timeout=None):
+        """
+        :param timeout: Seconds to wait for an idle worker, None = no limit
+        :raises WorkerTimeout: No worker became idle in time (e.g. all of them are restarting)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while not self._idle:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise WorkerTimeout(f"{self.name}: no worker became free within {timeout} s")
+                    self._cond.wait(remaining)
+                worker = self._idle.popleft()
+                if worker.process.is_alive():
+                    worker.busy = True
+                    return worker
+            self.crashes += 1
+            self._restart(worker, f"exited while idle with code {worker.process.exitcode}")
+
+    def _release(self, worker):
+        with self._cond:
+            worker.busy = False
+            current = self._is_current(worker)
+            if current:
+                self._idle.append(worker)
+                self._cond.notify()
+        # worker wyparty ze slotu przez _swap_in - zatrzymywany po identyczności, nie po fladze recycling:
+        # slot mógł w międzyczasie zająć worker z _restart, który flagi nie ma
+        if not current and not self._stopping:
+            self._retire(worker)
+
+    def run(self, job, timer=None, on_progress=None):
+        """
+        Runs a job on the first free ready worker (blocking).
+
+        :param job: Job dict sent to the worker
+        :param timer: Optional timing.StageTimer, receives the wait for a worker ("queue") and the worker's stages
+        :param on_progress: Optional callable receiving the stage events of the job, see ModelWorker.call
+        :return: Result returned by the worker
+        """
+        wait_start = time.perf_counter()
+        # czekanie na wolnego workera ograniczone tym samym terminem co samo zadanie
+        worker = self._acquire(self.job_timeout)
+        start = time.perf_counter()
+        if timer is not None:
+            timer.add("queue", start - wait_start)
+        try:
+            result = worker.call(job, self.job_timeout, timer, on_progress)
+        except (WorkerCrashed, WorkerTimeout) as e:
+            self.busy_seconds += time.perf_counter() - start
+            # tylko to zadanie kończy się błędem, worker jest zastępowany nowym procesem
+            if isinstance(e, WorkerTimeout):
+                self.timeouts += 1
+            else:
+                self.crashes += 1
+            self._restart(worker, e)
+            raise
+        except BaseException:
+            self.busy_seconds += time.perf_counter() - start
+            self._release(worker)
+            raise
+        elapsed = time.perf_counter() - start
+        self.busy_seconds += elapsed
+        worker.jobs += 1
+        self._release(worker)
+        reason = self._needs_recycling(worker)
+        if reason:
+            self._recycle(worker, reason)
+        self._avg_job_s = elapsed if self._avg_job_s is None else 0.8 * self._avg_job_s + 0.2 * elapsed
+        return result
+
+    def retry_after(self):
+        """Estimated seconds until a queue slot frees up."""
+        avg = self._avg_job_s or 10.0
+        return max(1, math.ceil(avg * (self.queued / self.max_concurrency + 1)))
+
+    def check_admission(self):
+        """Raises PoolBusy when the queue is full. Cheap, meant to be called before accepting an upload."""
+        if self.queued >= self.max_queue and self.running >= self.max_concurrency:
+            raise PoolBusy(self.name, self.retry_after())
+
+    async def submit(self, job, is_disconnected=None, timer=None, admit=True, on_progress=None):
+        """
+        Runs a job with admission control (must be awaited from the event loop).
+
+        :param job: Job dict sent to the worker
+        :param is_disconnected: Optional coroutine function, e.g. Request.is_disconnected; the job is dropped
+                                with JobCancelled if the client went away before it reached a worker
+        :param timer: Optional timing.StageTimer, see run()
+        :param admit: Apply admission control; False for follow-up jobs of an already admitted request
+        :param on_progress: Optional callable receiving the stage events of the job, called on the event loop
+        :return: Result returned by the worker
+        """
+        loop = asyncio.get_running_loop()
+        # zdarzenia z wątku wykonawcy przekazywane do pętli zdarzeń
+        forward = None if on_progress is None else (lambda event: loop.call_soon_threadsafe(on_progress, event))
+        if admit:
+            self.check_admission()
+        self.queued += 1
+        wait_start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._slots.acquire(), timeout=_DISCONNECT_POLL_S)
+                    break
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        raise JobCancelled()
+        finally:
+            self.queued -= 1
+            if timer is not None:
+                timer.add("queue", time.perf_counter() - wait_start)
+
+        try:
+            if is_disconnected is not None and await is_disconnected():
+                raise JobCancelled()
+            self.running += 1
+            try:
+                return await loop.run_in_executor(None, self.run, job, timer, forward)
+            finally:
+                self.running -= 1
+        finally:
+            self._slots.release()
+
+    def status(self):
+        ready = [w for w in self.workers if w.ready]
+        return {
+            "workers": len(self.workers),
+            "ready": len(ready),
+            "warm": any(w.info.get("warm") for w in ready),
+            "warmup_s": [w.info.get("warmup_s") for w in ready],
+            "start_method": self.context.get_start_method(),
+            "queued": self.queued,
+            "running": self.running,
+            "max_queue": self.max_queue,
+            "max_concurrency": self.max_concurrency,
+            "restarts": self.restarts,
+            "crashes": self.crashes,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "busy": sum(w.busy for w in self.workers),
+            "busy_seconds": self.busy_seconds,
+            "threads": self.threads,
+            "jobs": [w.jobs for w in self.workers],
+        }
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+        for worker in self.workers + list(self._pending.values()):
+            worker.stop()
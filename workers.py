@@ -1,38 +1,165 @@
-def crepe_worker(conn):
-    import crepe_convert
-    while True:
-        audio, preprocessing = conn.recv()
-        if audio is None:
-            return
+import os
+import sys
+import time
+
+import profiling
+import timing
+
+# Protokół potoku:
+#   proces API -> worker: słownik zadania, np. {"audio_path": ..., "preprocessing": False}, albo None (zakończenie);
+#                         opcjonalny klucz "profile" to ścieżka, pod którą worker zapisuje profil cProfile zadania;
+#                         klucz "kind" wybiera etap transkrypcji w częściach (crepe, patrz _crepe_job)
+#                         albo "notes" - sama lista nut, bez MIDI i MusicXML (oba modele);
+#                         przy "progress": True worker raportuje etapy na bieżąco; "xml": False pomija MusicXML;
+#                         "output_dir" - katalog zadania na MIDI i MusicXML (kilka workerów nie nadpisuje
+#                         sobie nawzajem plików), usuwany przez proces API po odczytaniu wyników;
+#                         "trim_silence": False (zadanie "notes") zachowuje ciszę przy preprocessingu części nagrania
+#   worker -> proces API: ("ready", info) raz po rozgrzaniu modelu, potem zero lub więcej
+#                         ("progress", (zdarzenie, etap, wartość)), a na końcu ("result", wynik, czasy etapów)
+#                         lub ("error", opis)
+
+
+_THREAD_ENV = (
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS", "TF_NUM_INTRAOP_THREADS",
+)
+
+
+def _apply_thread_budget(threads=None, cpus=None):
+    """
+    Limits the thread pools of the worker process and optionally pins it to CPUs.
+    Must run before the model is loaded.
+
+    :param threads: Threads for BLAS/OpenMP and TensorFlow intra-op parallelism, None = library defaults
+    :param cpus: CPU ids the process may run on, None = no pinning
+    :return: Dict describing the applied budget (reported with "ready")
+    """
+    info = {}
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+        info["cpus"] = sorted(os.sched_getaffinity(0))
+    if not threads:
+        return info
+
+    info["threads"] = threads
+    # zmienne środowiskowe działają, gdy biblioteki nie zostały jeszcze zaimportowane (spawn)
+    for var in _THREAD_ENV:
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    # przy fork / forkserver numpy i TensorFlow są już załadowane - limity trzeba ustawić bezpośrednio
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(threads)
+    if "tensorflow" in sys.modules:
+        tf = sys.modules["tensorflow"]
         try:
-            result = crepe_convert.convert(audio_path=audio, preprocessing=preprocessing)
-            conn.send(result)
-        except Exception as e:
-            print(f"Crepe worker exception: {e}")
-            conn.send(("", ""))
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError as e:
+            # runtime TensorFlow zainicjalizowany przed forkiem (FASTSCORE_PRELOAD_WEIGHTS=1)
+            info["tf_threads_error"] = str(e)
+    return info
+
+
+def _serve(conn, name, warm_up, handle, budget=None):
+    info = {"model": name, **(budget or {})}
+    start = time.perf_counter()
+    try:
+        warm_up()
+        info["warm"] = True
+    except Exception as e:
+        print(f"{name} warm-up failed: {e}")
+        info["warm"] = False
+        info["error"] = str(e)
+    info["warmup_s"] = round(time.perf_counter() - start, 3)
+    conn.send(("ready", info))
 
-def basic_pitch_worker(conn):
-    import basic_pitch_convert
     while True:
-        audio, _ = conn.recv()
-        if audio is None:
+        job = conn.recv()
+        if job is None:
             return
         try:
-            result = basic_pitch_convert.convert(audio_path=audio)
-            conn.send(result)
+            listener = _progress_sender(conn) if job.get("progress") else None
+            with timing.collect(listener=listener) as timer:
+                result = _profiled(handle, job) if job.get("profile") else handle(job)
+            conn.send(("result", result, timer.stages))
         except Exception as e:
-            print(f"Crepe worker exception: {e}")
-            conn.send(("", ""))
+            print(f"{name} worker exception: {e}")
+            conn.send(("error", str(e)))
+
+
+def _progress_sender(conn):
+    # zdarzenia StageTimer (event, etap, wartość) przekazywane do procesu API bez zmian
+    def send(event, stage, value):
+        conn.send(("progress", (event, stage, value)))
+    return send
+
+
+def _profiled(handle, job):
+    import cProfile
 
-def melody_ext_worker(conn):
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(handle, job)
+    finally:
+        profiler.dump_stats(job["profile"])
+        profiling.write_summary(job["profile"])
+
+
+def _crepe_job(job):
+    import crepe_convert
+
+    kind = job.get("kind", "convert")
+    if kind == "split":
+        return crepe_convert.split_at_silence(
+            job["audio_path"], job["chunk_dir"], job["parts"], min_duration=job.get("min_duration", 120.0)
+        )
+    if kind == "notes":
+        return crepe_convert.transcribe_notes(
+            job["audio_path"], preprocessing=job.get("preprocessing", False),
+            trim_silence=job.get("trim_silence", True),
+        )
+    if kind == "pitch":
+        return crepe_convert.pitch_track(job["samples"], job.get("sample_rate", 16000))
+    if kind == "tempo":
+        return crepe_convert.notes_tools.predict_tempo(job["audio_path"])
+    if kind == "score":
+        return crepe_convert.notes_to_score(
+            job["notes"], job["bpm"], xml=job.get("xml", True), output_dir=job.get("output_dir")
+        )
+    return crepe_convert.convert(
+        audio_path=job["audio_path"], preprocessing=job.get("preprocessing", False), xml=job.get("xml", True),
+        output_dir=job.get("output_dir"),
+    )
+
+
+def crepe_worker(conn, threads=None, cpus=None):
+    budget = _apply_thread_budget(threads, cpus)
+    import crepe_convert
+    _serve(conn, "crepe", crepe_convert.warm_up, _crepe_job, budget)
+
+
+def _basic_pitch_job(job):
+    import basic_pitch_convert
+
+    if job.get("kind") == "notes":
+        return basic_pitch_convert.transcribe_notes(job["audio_path"])
+    return basic_pitch_convert.convert(
+        audio_path=job["audio_path"], xml=job.get("xml", True), output_dir=job.get("output_dir")
+    )
+
+
+def basic_pitch_worker(conn, threads=None, cpus=None):
+    budget = _apply_thread_budget(threads, cpus)
+    import basic_pitch_convert
+    _serve(conn, "basic_pitch", basic_pitch_convert.warm_up, _basic_pitch_job, budget)
+
+
+def melody_ext_worker(conn, threads=None, cpus=None):
+    budget = _apply_thread_budget(threads, cpus)
     import melodia_convert
-    while True:
-        audio, _ = conn.recv()
-        if audio is None:
-            return
-        try:
-            result = melodia_convert.convert(audio_path=audio)
-            conn.send(result)
-        except Exception as e:
-            print(f"Crepe worker exception: {e}")
-            conn.send(("", ""))
\ No newline at end of file
+    _serve(
+        conn, "melody_ext", lambda: None,
+        lambda job: melodia_convert.convert(audio_path=job["audio_path"]),
+        budget,
+    )